@@ -0,0 +1,45 @@
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+ARCHIVE_CONTENT_TYPES = {
+    "application/zip",
+    "application/x-zip-compressed",
+    "application/x-tar",
+    "application/gzip",
+    "application/x-gzip",
+    "application/x-gtar",
+}
+
+
+def is_archive(filename: Optional[str], content_type: Optional[str]) -> bool:
+    name = (filename or "").lower()
+    return content_type in ARCHIVE_CONTENT_TYPES or name.endswith((".zip", ".tar", ".tar.gz", ".tgz"))
+
+
+def iter_archive_images(fileobj: BinaryIO, filename: Optional[str]) -> Iterator[Tuple[str, bytes]]:
+    """Đọc lần lượt từng ảnh trong file zip/tar, trả về (tên, bytes)
+
+    Mỗi ảnh chỉ được đọc vào bộ nhớ khi đến lượt, không giải nén cả file.
+    """
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    yield info.filename, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    try:
+        archive = tarfile.open(fileobj=fileobj, mode="r:*")
+    except tarfile.TarError:
+        raise ValueError(f"Không đọc được file nén: {filename}")
+    with archive:
+        for member in archive:
+            if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS):
+                extracted = archive.extractfile(member)
+                if extracted is not None:
+                    yield member.name, extracted.read()
@@ -0,0 +1,70 @@
+"""So sánh tiền xử lý cv2 (preprocess_leaves) với pipeline PIL ban đầu.
+
+Đo thời gian tiền xử lý một batch crop và độ lệch số học giữa hai cách.
+Trả về mã lỗi 1 nếu độ lệch trung bình vượt ngưỡng ``--max-mean-drift``.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python bench_preprocess.py --crops 32 --repeats 20
+"""
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from image_processing import preprocess_leaves, transform
+
+
+def make_crops(count: int, seed: int = 0):
+    """Tạo các crop ngẫu nhiên từ một ảnh tổng hợp có cấu trúc mượt như ảnh thật"""
+    rng = np.random.default_rng(seed)
+    img = rng.integers(0, 256, (1200, 1600, 3), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (21, 21), 0)
+    crops = []
+    for _ in range(count):
+        w, h = rng.integers(40, 700, size=2)
+        x, y = rng.integers(0, 1600 - w), rng.integers(0, 1200 - h)
+        crops.append(img[y:y + h, x:x + w])
+    return crops
+
+
+def time_it(fn, repeats: int) -> float:
+    fn()
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - started) / repeats * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tiền xử lý crop lá")
+    parser.add_argument("--crops", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--max-mean-drift", type=float, default=0.05,
+                        help="Ngưỡng độ lệch tuyệt đối trung bình (đơn vị sau chuẩn hóa)")
+    args = parser.parse_args(argv)
+
+    crops = make_crops(args.crops)
+
+    reference = torch.stack([transform(c) for c in crops])
+    fast = preprocess_leaves(crops, 448).clone()
+    diff = (reference - fast).abs()
+
+    pil_ms = time_it(lambda: torch.stack([transform(c) for c in crops]), args.repeats)
+    cv2_ms = time_it(lambda: preprocess_leaves(crops, 448), args.repeats)
+
+    print(f"PIL transform : {pil_ms:8.2f} ms / {args.crops} crop")
+    print(f"cv2 fused     : {cv2_ms:8.2f} ms / {args.crops} crop ({pil_ms / cv2_ms:.1f}x)")
+    print(f"Độ lệch       : max {diff.max().item():.4f}, trung bình {diff.mean().item():.5f}")
+
+    if diff.mean().item() > args.max_mean_drift:
+        print("Độ lệch vượt ngưỡng cho phép")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
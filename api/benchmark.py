@@ -0,0 +1,257 @@
+"""Benchmark offline cho pipeline phát hiện và phân loại lá.
+
+Đo từng bước của ``process_leaf_image`` (giải mã, YOLO, cắt lá, tiền xử lý,
+ResNet, tổng hợp) và cả pipeline trên ảnh tổng hợp cùng ảnh mẫu (nếu có),
+rồi đo thông lượng theo kích thước batch và số luồng CPU. Kết quả gồm
+p50/p95/p99, ảnh/giây và RSS cực đại, ghi ra JSON để so sánh giữa các commit.
+
+Khi thiếu ``best.pt`` hoặc ``pbl5_ver4.pth``, mô hình tương ứng được khởi tạo
+ngẫu nhiên (không cần mạng). YOLO ngẫu nhiên gần như không phát hiện được lá
+nên mỗi ảnh được gán ``--synthetic-leaves`` box giả sau khi YOLO chạy xong,
+để các bước sau vẫn được đo với số lá thực tế.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python benchmark.py --images ../samples --json-out bench.json
+    python benchmark.py --batch-sizes 1 4 8 --threads 1 2 4 --repeats 30
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+import torch
+
+import handler
+from engines import EagerClassifier, build_resnet_model
+from image_processing import preprocess_leaves
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class SyntheticBoxDetector:
+    """Chạy YOLO thật rồi thay kết quả rỗng bằng box giả cố định cho mỗi ảnh"""
+
+    def __init__(self, detector, leaves: int, seed: int = 0):
+        self.detector = detector
+        self.leaves = leaves
+        self.rng = np.random.default_rng(seed)
+
+    def _boxes(self, h: int, w: int) -> torch.Tensor:
+        side = self.rng.uniform(0.1, 0.3, (self.leaves, 2)) * (w, h)
+        x1 = self.rng.uniform(0, 1, self.leaves) * (w - side[:, 0])
+        y1 = self.rng.uniform(0, 1, self.leaves) * (h - side[:, 1])
+        conf = self.rng.uniform(0.5, 1.0, self.leaves)
+        boxes = np.stack([x1, y1, x1 + side[:, 0], y1 + side[:, 1], conf, np.zeros(self.leaves)], axis=1)
+        return torch.from_numpy(boxes.astype(np.float32))
+
+    def predict(self, source, **kwargs):
+        results = self.detector.predict(source=source, **kwargs)
+        for result in results:
+            if len(result.boxes) == 0:
+                h, w = result.orig_shape
+                result.update(boxes=self._boxes(h, w))
+        return results
+
+
+def setup_models(synthetic_leaves: int) -> Dict[str, str]:
+    """Nạp mô hình thật nếu có file trọng số, ngược lại khởi tạo ngẫu nhiên"""
+    sources = {}
+    if os.path.exists(handler.MODEL_YOLO_PATH):
+        handler.yolo_model = handler.load_detector(handler.MODEL_YOLO_PATH, handler.DETECTOR_BACKEND)
+        sources["yolo"] = f"{handler.MODEL_YOLO_PATH} ({handler.DETECTOR_BACKEND})"
+    else:
+        from ultralytics import YOLO
+        handler.yolo_model = SyntheticBoxDetector(YOLO("yolov8n.yaml"), synthetic_leaves)
+        sources["yolo"] = f"random yolov8n + {synthetic_leaves} box giả/ảnh"
+
+    if os.path.exists(handler.MODEL_RESNET_PATH):
+        handler.load_models()
+        sources["resnet"] = f"{handler.MODEL_RESNET_PATH} ({handler.CLASSIFIER_BACKEND})"
+    else:
+        handler.classifier = EagerClassifier(build_resnet_model(handler.num_classes).eval(), handler.device)
+        sources["resnet"] = "random resnet18 (eager)"
+    handler.model_status["loaded"] = True
+    return sources
+
+
+def load_samples(folder: Optional[str], synthetic: int) -> List[Dict]:
+    """Ảnh tổng hợp kích thước WARMUP_FRAME_SIZE cộng với ảnh mẫu trong ``folder``"""
+    samples = []
+    rng = np.random.default_rng(0)
+    h, w = handler.WARMUP_FRAME_SIZE
+    for i in range(synthetic):
+        img = cv2.GaussianBlur(rng.integers(0, 256, (h, w, 3), dtype=np.uint8), (31, 31), 0)
+        samples.append({"name": f"synthetic-{i}", "bytes": cv2.imencode(".jpg", img)[1].tobytes()})
+    if folder:
+        for name in sorted(os.listdir(folder)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(folder, name), "rb") as f:
+                    samples.append({"name": name, "bytes": f.read()})
+    return samples
+
+
+def summarize(times_ms: List[float]) -> Dict[str, float]:
+    values = np.asarray(times_ms)
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+    }
+
+
+def measure(fn: Callable, repeats: int) -> List[float]:
+    times = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000.0)
+    return times
+
+
+def bench_stages(samples: List[Dict], repeats: int) -> Dict[str, Dict]:
+    """Đo riêng từng bước và cả process_leaf_image trên mọi ảnh"""
+    stages: Dict[str, List[float]] = {
+        name: [] for name in ("decode", "yolo", "crop", "preprocess", "resnet", "aggregate", "end_to_end")
+    }
+    leaves_per_image = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for sample in samples:
+            data = sample["bytes"]
+            path = os.path.join(tmp, "frame.jpg")
+            with open(path, "wb") as f:
+                f.write(data)
+
+            img = handler.decode_image(data)
+            boxes = handler.detect_leaves([img])[0][0]
+            leaves = handler.crop_leaves(img, boxes)
+            leaves_per_image.append(len(leaves))
+            batch = preprocess_leaves(leaves, handler.RESNET_INPUT_SIZE).clone() if leaves else None
+            pred_classes, confidences = handler.classify_leaves(leaves) if leaves else (None, None)
+
+            stages["decode"] += measure(lambda: handler.decode_image(data), repeats)
+            stages["yolo"] += measure(lambda: handler.detect_leaves([img]), repeats)
+            stages["crop"] += measure(lambda: handler.crop_leaves(img, boxes), repeats)
+            if leaves:
+                stages["preprocess"] += measure(lambda: preprocess_leaves(leaves, handler.RESNET_INPUT_SIZE), repeats)
+                stages["resnet"] += measure(lambda: handler.classifier(batch), repeats)
+                stages["aggregate"] += measure(lambda: handler.summarize_predictions(pred_classes, confidences), repeats)
+            stages["end_to_end"] += measure(lambda: handler.process_leaf_image(path), repeats)
+
+    report = {name: summarize(times) for name, times in stages.items() if times}
+    report["leaves_per_image"] = float(np.mean(leaves_per_image)) if leaves_per_image else 0.0
+    return report
+
+
+def bench_throughput(samples: List[Dict], batch_sizes: List[int], threads: List[int], repeats: int) -> List[Dict]:
+    """Ảnh/giây của process_leaf_batch theo số luồng torch và kích thước batch"""
+    images = [handler.decode_image(sample["bytes"]) for sample in samples]
+    default_threads = torch.get_num_threads()
+    rows = []
+    try:
+        for num_threads in threads:
+            torch.set_num_threads(num_threads)
+            for batch_size in batch_sizes:
+                batch = [images[i % len(images)] for i in range(batch_size)]
+                handler.process_leaf_batch(batch)
+                times = measure(lambda: handler.process_leaf_batch(batch), repeats)
+                rows.append({
+                    "threads": num_threads,
+                    "batch_size": batch_size,
+                    "images_per_second": batch_size * 1000.0 / float(np.mean(times)),
+                    **summarize(times),
+                })
+                print(f"  {num_threads} luồng, batch {batch_size}: "
+                      f"{rows[-1]['images_per_second']:.2f} ảnh/s, p95 {rows[-1]['p95_ms']:.1f} ms")
+    finally:
+        torch.set_num_threads(default_threads)
+    return rows
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss tính bằng kB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark offline pipeline YOLO + ResNet")
+    parser.add_argument("--images", help="Thư mục ảnh mẫu (tùy chọn)")
+    parser.add_argument("--synthetic", type=int, default=2, help="Số ảnh tổng hợp")
+    parser.add_argument("--synthetic-leaves", type=int, default=8,
+                        help="Số box giả mỗi ảnh khi dùng YOLO khởi tạo ngẫu nhiên")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 4, 8])
+    parser.add_argument("--threads", nargs="+", type=int, default=sorted({1, torch.get_num_threads()}))
+    parser.add_argument("--json-out", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args(argv)
+
+    sources = setup_models(args.synthetic_leaves)
+    samples = load_samples(args.images, args.synthetic)
+    if not samples:
+        print("Không có ảnh nào để benchmark")
+        return 1
+
+    print(f"Mô hình: YOLO = {sources['yolo']}, ResNet = {sources['resnet']}; {len(samples)} ảnh")
+    handler.warmup()
+
+    stages = bench_stages(samples, args.repeats)
+    print(f"{'bước':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, stats in stages.items():
+        if isinstance(stats, dict):
+            print(f"{name:<12}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    print(f"Trung bình {stages['leaves_per_image']:.1f} lá/ảnh")
+
+    print("Thông lượng:")
+    throughput = bench_throughput(samples, args.batch_sizes, args.threads, args.repeats)
+    peak = peak_rss_mb()
+    print(f"RSS cực đại: {peak:.1f} MB")
+
+    if args.json_out:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch": torch.__version__,
+            "models": sources,
+            "config": {
+                "detector_backend": handler.DETECTOR_BACKEND,
+                "classifier_backend": handler.CLASSIFIER_BACKEND,
+                "resnet_input_size": handler.RESNET_INPUT_SIZE,
+                "resnet_batch_size": handler.RESNET_BATCH_SIZE,
+                "tiled_detection": handler.TILED_DETECTION,
+                "cascade": handler.CASCADE_ENABLED,
+                "images": [sample["name"] for sample in samples],
+                "repeats": args.repeats,
+            },
+            "stages": stages,
+            "throughput": throughput,
+            "peak_rss_mb": peak,
+        }
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả -> {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+
+class LeafCostEstimator:
+    """Ước lượng thời gian ResNet cho mỗi lá theo từng kích thước đầu vào (EMA)
+
+    Kích thước chưa đo được suy ra từ kích thước đã đo gần nhất theo tỉ lệ
+    diện tích ảnh, vì chi phí conv tăng gần tuyến tính theo số pixel.
+    """
+
+    def __init__(self, default_ms: float, alpha: float = 0.2):
+        self.default_ms = default_ms
+        self.alpha = alpha
+        self._ms_per_leaf: Dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def update(self, size: int, leaves: int, elapsed_ms: float):
+        if leaves <= 0:
+            return
+        per_leaf = elapsed_ms / leaves
+        with self._lock:
+            previous = self._ms_per_leaf.get(size)
+            self._ms_per_leaf[size] = per_leaf if previous is None else (
+                self.alpha * per_leaf + (1 - self.alpha) * previous
+            )
+
+    def ms_per_leaf(self, size: int) -> float:
+        with self._lock:
+            if size in self._ms_per_leaf:
+                return self._ms_per_leaf[size]
+            if not self._ms_per_leaf:
+                return self.default_ms
+            measured = min(self._ms_per_leaf, key=lambda s: abs(s - size))
+            return self._ms_per_leaf[measured] * (size / measured) ** 2
+
+    def snapshot(self) -> Dict[int, float]:
+        with self._lock:
+            return {size: round(ms, 2) for size, ms in sorted(self._ms_per_leaf.items())}
+
+
+def plan_leaves(scores: np.ndarray, areas: np.ndarray, allowance_ms: float,
+                estimator: LeafCostEstimator, sizes: Sequence[int],
+                min_score: float, min_area: int) -> Tuple[np.ndarray, int, List[Dict]]:
+    """Chọn các lá sẽ phân loại và kích thước đầu vào để vừa thời gian cho phép.
+
+    Trả về (chỉ số lá xếp theo độ tin cậy phát hiện giảm dần, kích thước ResNet,
+    danh sách bước giảm chất lượng đã áp dụng). ``sizes`` xếp giảm dần, phần tử
+    đầu là kích thước đầy đủ. Thứ tự giảm: bỏ lá giá trị thấp, hạ kích thước
+    đầu vào, rồi mới cắt bớt số lá. Luôn giữ ít nhất một lá.
+    """
+    detected = len(scores)
+    order = np.argsort(-scores, kind="stable")
+    full_size = sizes[0]
+    if detected == 0 or detected * estimator.ms_per_leaf(full_size) <= allowance_ms:
+        return order, full_size, []
+
+    degradations = []
+    # 1. Bỏ các lá nhỏ hoặc YOLO không chắc chắn
+    keep = order[(scores[order] >= min_score) & (areas[order] >= min_area)]
+    if len(keep) == 0:
+        keep = order[:1]
+    if len(keep) < detected:
+        degradations.append({"type": "skip_low_value", "skipped": int(detected - len(keep))})
+
+    # 2. Hạ kích thước đầu vào ResNet đến khi vừa (hoặc đến kích thước nhỏ nhất)
+    size = full_size
+    for size in sizes:
+        if len(keep) * estimator.ms_per_leaf(size) <= allowance_ms:
+            break
+    if size != full_size:
+        degradations.append({"type": "lower_resolution", "input_size": int(size)})
+
+    # 3. Chỉ giữ các lá có độ tin cậy phát hiện cao nhất
+    cap = max(1, int(allowance_ms // estimator.ms_per_leaf(size)))
+    if len(keep) > cap:
+        degradations.append({"type": "cap_crops", "kept": cap, "dropped": int(len(keep) - cap)})
+        keep = keep[:cap]
+
+    if len(keep) * estimator.ms_per_leaf(size) > allowance_ms:
+        degradations.append({"type": "budget_exceeded"})
+    return keep, size, degradations
+
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+def content_hash(data: bytes) -> str:
+    """Hash nội dung bytes của ảnh, dùng cho cache trùng khớp tuyệt đối"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def perceptual_hash(img: np.ndarray) -> int:
+    """dHash 64 bit: so sánh độ sáng các điểm ảnh liền kề trên ảnh thu nhỏ 9x8"""
+    gray = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class PredictionCache:
+    """Cache kết quả dự đoán theo hash nội dung, có thể khớp gần đúng theo dHash.
+
+    Giới hạn ``max_entries`` mục (loại bỏ theo LRU) và mỗi mục hết hạn sau
+    ``ttl_seconds``. ``phash_distance`` < 0 tắt chế độ khớp gần đúng.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 60.0, phash_distance: int = -1):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.phash_distance = phash_distance
+        self._entries: "OrderedDict[str, Tuple[Any, Optional[int], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._near_hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @property
+    def near_duplicates_enabled(self) -> bool:
+        return self.enabled and self.phash_distance >= 0
+
+    def _expired(self, created_at: float, now: float) -> bool:
+        return self.ttl > 0 and now - created_at > self.ttl
+
+    def get(self, key: str) -> Optional[Any]:
+        """Tìm kết quả theo hash nội dung, ``None`` nếu không có"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[2], time.monotonic()):
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return entry[0]
+                del self._entries[key]
+            return None
+
+    def get_similar(self, phash: int) -> Optional[Any]:
+        """Tìm kết quả của ảnh gần giống nhất trong ngưỡng ``phash_distance``"""
+        if not self.near_duplicates_enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_distance = None, self.phash_distance + 1
+            for key, (_, entry_phash, created_at) in list(self._entries.items()):
+                if self._expired(created_at, now):
+                    del self._entries[key]
+                    continue
+                if entry_phash is None:
+                    continue
+                distance = hamming_distance(phash, entry_phash)
+                if distance < best_distance:
+                    best_key, best_distance = key, distance
+            if best_key is None:
+                return None
+            self._entries.move_to_end(best_key)
+            self._near_hits += 1
+            return self._entries[best_key][0]
+
+    def record_miss(self):
+        with self._lock:
+            self._misses += 1
+
+    def put(self, key: str, result: Any, phash: Optional[int] = None):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (result, phash, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._hits + self._near_hits + self._misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "phash_distance": self.phash_distance,
+                "hits": self._hits,
+                "near_hits": self._near_hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_ratio": (self._hits + self._near_hits) / lookups if lookups else 0.0,
+            }
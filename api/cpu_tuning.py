@@ -0,0 +1,242 @@
+"""Cấu hình số luồng torch và ghim CPU cho từng worker.
+
+Mặc định mỗi tiến trình torch dùng hết số lõi, nên với nhiều worker các
+luồng tranh nhau CPU và thông lượng giảm mạnh. Module này:
+
+* ``apply_cpu_profile``: đặt số luồng intra-op/inter-op và ghim worker vào
+  một nhóm lõi riêng theo thứ tự ưu tiên: biến môi trường ``TORCH_NUM_THREADS``,
+  ``TORCH_INTEROP_THREADS``, ``CPU_PIN_WORKERS`` > file profile
+  ``CPU_PROFILE_PATH`` (nếu được tạo cho cùng số worker) > chia đều số lõi.
+* ``autotune``: chạy thử pipeline trên ảnh lá thật với các tổ hợp số luồng
+  và ghim lõi, mỗi tổ hợp chạy đủ số worker song song, rồi lưu tổ hợp có
+  thông lượng cao nhất vào file profile để các lần khởi động sau dùng lại.
+  Ảnh mẫu phải có lá để cả YOLO lẫn ResNet đều được đo.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python cpu_tuning.py --workers 4 --duration 10 --images ../samples
+    # tự chạy nếu chưa có profile
+    CPU_AUTOTUNE=1 CPU_AUTOTUNE_IMAGES=../samples python serve.py --workers 4
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import traceback
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+
+CPU_PROFILE_PATH = os.getenv("CPU_PROFILE_PATH", "cpu_profile.json")
+
+
+def available_cores() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def load_profile(path: str = CPU_PROFILE_PATH) -> Optional[Dict]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def resolve_settings(workers: int, profile: Optional[Dict] = None) -> Dict:
+    """Chọn cấu hình luồng cho ``workers`` tiến trình (chưa áp dụng)"""
+    cores = available_cores()
+    settings = {
+        "intra_op_threads": max(1, len(cores) // workers),
+        "inter_op_threads": 1,
+        "pin_workers": False,
+        "source": "default",
+    }
+    if profile and profile.get("workers") == workers and profile.get("cpu_count") == len(cores):
+        settings.update({key: profile[key] for key in ("intra_op_threads", "inter_op_threads", "pin_workers")})
+        settings["source"] = "profile"
+
+    overrides = {
+        "intra_op_threads": os.getenv("TORCH_NUM_THREADS"),
+        "inter_op_threads": os.getenv("TORCH_INTEROP_THREADS"),
+        "pin_workers": os.getenv("CPU_PIN_WORKERS"),
+    }
+    for key, value in overrides.items():
+        if value:
+            settings[key] = value == "1" if key == "pin_workers" else int(value)
+            settings["source"] = "env"
+    return settings
+
+
+def worker_cores(worker_index: int, workers: int) -> List[int]:
+    """Nhóm lõi riêng của một worker"""
+    cores = available_cores()
+    per_worker = max(1, len(cores) // workers)
+    start = (worker_index * per_worker) % len(cores)
+    return cores[start:start + per_worker]
+
+
+def apply_settings(settings: Dict, worker_index: int = 0, workers: int = 1) -> Dict:
+    torch.set_num_threads(settings["intra_op_threads"])
+    try:
+        torch.set_num_interop_threads(settings["inter_op_threads"])
+    except RuntimeError:
+        # Chỉ đặt được trước khi pool inter-op khởi động
+        settings["inter_op_threads"] = torch.get_num_interop_threads()
+    applied = dict(settings)
+    if settings["pin_workers"] and hasattr(os, "sched_setaffinity"):
+        cores = worker_cores(worker_index, workers)
+        os.sched_setaffinity(0, cores)
+        applied["cores"] = cores
+    return applied
+
+
+def apply_cpu_profile(worker_index: int = 0, workers: int = 1) -> Dict:
+    """Áp dụng cấu hình luồng cho tiến trình hiện tại, trả về cấu hình đã dùng"""
+    return apply_settings(resolve_settings(workers, load_profile()), worker_index, workers)
+
+
+def candidate_settings(workers: int) -> List[Dict]:
+    per_worker = max(1, len(available_cores()) // workers)
+    intra = sorted({1, per_worker} | {n for n in (2, 4, 8, 16) if n < per_worker})
+    candidates = []
+    for intra_op in intra:
+        for inter_op in (1, 2):
+            for pin in (False, True) if workers > 1 else (False,):
+                candidates.append({"intra_op_threads": intra_op, "inter_op_threads": inter_op, "pin_workers": pin})
+    return candidates
+
+
+def _run_trial_worker(settings: Dict, worker_index: int, workers: int, images: List[np.ndarray],
+                      batch_size: int, duration: float) -> int:
+    import handler
+    apply_settings(dict(settings), worker_index, workers)
+    batch = [images[i % len(images)] for i in range(batch_size)]
+    # Không có lá thì ResNet không chạy và thông lượng chỉ đo riêng YOLO
+    if not sum(len(results) for results in handler.process_leaf_batch(batch)):
+        raise RuntimeError("Không phát hiện được lá nào trong ảnh mẫu, ResNet không được đo")
+    processed = 0
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        handler.process_leaf_batch(batch)
+        processed += len(batch)
+    return processed
+
+
+def run_trial(settings: Dict, workers: int, images: List[np.ndarray], batch_size: int,
+              duration: float) -> Optional[float]:
+    """Chạy ``workers`` tiến trình con song song với cấu hình cho trước, trả về ảnh/giây
+
+    Trả về None nếu có worker lỗi (traceback đã in ra stderr của worker đó),
+    vì thông lượng của số worker còn lại không đại diện cho cấu hình này.
+    """
+    pipes, pids = [], []
+    started = time.monotonic()
+    for worker_index in range(workers):
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            code = 1
+            try:
+                processed = _run_trial_worker(settings, worker_index, workers, images, batch_size, duration)
+                os.write(write_fd, str(processed).encode())
+                code = 0
+            except BaseException:
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        os.close(write_fd)
+        pipes.append(read_fd)
+        pids.append(pid)
+
+    total, failed = 0, 0
+    for read_fd, pid in zip(pipes, pids):
+        with os.fdopen(read_fd) as f:
+            output = f.read()
+        _, status = os.waitpid(pid, 0)
+        if os.waitstatus_to_exitcode(status) != 0 or not output:
+            failed += 1
+        else:
+            total += int(output)
+    if failed:
+        return None
+    return total / (time.monotonic() - started)
+
+
+def autotune(workers: int, images_dir: str, duration: float = 10.0, batch_size: int = 1,
+             path: str = CPU_PROFILE_PATH) -> Dict:
+    """Thử các tổ hợp số luồng/ghim lõi và lưu tổ hợp nhanh nhất vào ``path``
+
+    Không chạy mô hình ở tiến trình gọi hàm: mỗi lần thử fork ra các worker
+    riêng, vì OpenMP không an toàn khi fork sau khi đã chạy song song. Tổ
+    hợp có worker lỗi (kể cả khi ảnh mẫu không có lá) bị bỏ; nếu không tổ
+    hợp nào chạy được thì báo RuntimeError và không ghi profile.
+    """
+    import handler
+    from benchmark import load_samples, setup_models
+
+    # Dùng mô hình đã nạp (serve.py), nếu chưa có thì nạp hoặc khởi tạo ngẫu nhiên như benchmark.py
+    if handler.yolo_model is None or handler.classifier is None:
+        setup_models(synthetic_leaves=8)
+    if not images_dir or not os.path.isdir(images_dir):
+        raise RuntimeError(f"Cần thư mục ảnh lá mẫu để dò cấu hình: {images_dir!r}")
+    images = [handler.decode_image(sample["bytes"]) for sample in load_samples(images_dir, 0)]
+    if not images:
+        raise RuntimeError(f"Không có ảnh mẫu nào trong {images_dir}")
+
+    results, failed = [], []
+    for settings in candidate_settings(workers):
+        throughput = run_trial(settings, workers, images, batch_size, duration)
+        label = (f"  intra={settings['intra_op_threads']} inter={settings['inter_op_threads']} "
+                 f"ghim={'có' if settings['pin_workers'] else 'không'}")
+        if throughput is None:
+            failed.append(settings)
+            print(f"{label}: lỗi, bỏ qua")
+            continue
+        results.append({**settings, "images_per_second": throughput})
+        print(f"{label}: {throughput:.2f} ảnh/s")
+
+    if not results:
+        raise RuntimeError(f"Mọi tổ hợp đều lỗi, không ghi profile {path}")
+
+    best = max(results, key=lambda row: row["images_per_second"])
+    profile = {
+        **best,
+        "workers": workers,
+        "cpu_count": len(available_cores()),
+        "batch_size": batch_size,
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "trials": results,
+        "failed_trials": failed,
+    }
+    with open(path, "w") as f:
+        json.dump(profile, f, indent=2)
+    print(f"Cấu hình tốt nhất: intra={best['intra_op_threads']} inter={best['inter_op_threads']} "
+          f"ghim={best['pin_workers']} ({best['images_per_second']:.2f} ảnh/s) -> {path}")
+    return profile
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Dò số luồng torch và cách ghim CPU tốt nhất")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "2")))
+    parser.add_argument("--duration", type=float, default=10.0, help="Số giây chạy mỗi tổ hợp")
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--images", required=True, help="Thư mục ảnh lá mẫu (cần có lá để đo cả ResNet)")
+    parser.add_argument("--output", default=CPU_PROFILE_PATH)
+    args = parser.parse_args(argv)
+    try:
+        autotune(max(1, args.workers), args.images, args.duration, args.batch_size, args.output)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
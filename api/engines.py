@@ -0,0 +1,186 @@
+"""Các backend suy luận CPU/GPU cho ResNet và YOLO.
+
+Backend được chọn theo cấu hình:
+
+* ``eager``: PyTorch eager (``pbl5_ver4.pth``, ``best.pt``)
+* ``torchscript``: mô hình đã trace (``pbl5_ver4.torchscript.pt``, ``best.torchscript``)
+* ``onnx``: ONNX Runtime CPU (``pbl5_ver4.onnx``, ``best.onnx``)
+* ``int8``: chỉ cho ResNet, mô hình lượng tử hóa (``pbl5_ver4.int8.torchscript.pt``)
+
+Các file torchscript/onnx được tạo bằng ``export_models.py``, file int8 bằng
+``quantize.py``.
+"""
+import json
+import os
+
+import torch
+import torch.nn as nn
+from torchvision import models
+
+BACKENDS = ("eager", "torchscript", "onnx")
+CLASSIFIER_BACKENDS = BACKENDS + ("int8",)
+
+
+def build_resnet_model(num_classes: int) -> nn.Module:
+    """Kiến trúc ResNet18 với đầu phân loại MLP dùng khi huấn luyện"""
+    resnet_model = models.resnet18(weights=None)
+    for param in resnet_model.parameters():
+        param.requires_grad = False
+    for param in resnet_model.layer2.parameters():
+        param.requires_grad = True
+    for param in resnet_model.layer3.parameters():
+        param.requires_grad = True
+    for param in resnet_model.layer4.parameters():
+        param.requires_grad = True
+
+    num_ftrs = resnet_model.fc.in_features
+    resnet_model.fc = nn.Sequential(
+        nn.BatchNorm1d(num_ftrs),
+        nn.Dropout(0.5),
+        nn.Linear(num_ftrs, 512),
+        nn.ReLU(),
+        nn.BatchNorm1d(512),
+        nn.Dropout(0.4),
+        nn.Linear(512, 256),
+        nn.ReLU(),
+        nn.BatchNorm1d(256),
+        nn.Dropout(0.4),
+        nn.Linear(256, num_classes)
+    )
+    return resnet_model
+
+
+def load_resnet_model(path: str, num_classes: int, device: torch.device) -> nn.Module:
+    """Nạp trọng số ResNet eager từ checkpoint state_dict.
+
+    Trên CPU checkpoint được memory-map và gán thẳng vào mô hình: trang nhớ
+    chỉ được đọc khi dùng và được chia sẻ qua page cache giữa các worker.
+    """
+    resnet_model = build_resnet_model(num_classes)
+    if device.type == "cpu":
+        try:
+            state = torch.load(path, map_location=device, mmap=True, weights_only=True)
+            resnet_model.load_state_dict(state, assign=True)
+        except RuntimeError:
+            # Checkpoint định dạng cũ không hỗ trợ mmap
+            resnet_model.load_state_dict(torch.load(path, map_location=device))
+    else:
+        resnet_model.load_state_dict(torch.load(path, map_location=device))
+    resnet_model.eval()
+    return resnet_model.to(device)
+
+
+def exported_path(path: str, backend: str) -> str:
+    """Đường dẫn file đã export tương ứng với checkpoint gốc"""
+    root, ext = os.path.splitext(path)
+    if backend == "eager":
+        return path
+    if backend == "onnx":
+        return root + ".onnx"
+    if backend == "int8":
+        return root + ".int8.torchscript.pt"
+    # ultralytics đặt tên best.torchscript, ResNet dùng .torchscript.pt
+    return root + (".torchscript" if ext == ".pt" else ".torchscript.pt")
+
+
+def report_path(path: str) -> str:
+    """File báo cáo hiệu chỉnh INT8 đi kèm mô hình lượng tử hóa"""
+    return os.path.splitext(path)[0] + ".int8.json"
+
+
+def _require(path: str, backend: str):
+    if not os.path.exists(path):
+        tool = "quantize.py" if backend == "int8" else "export_models.py"
+        hint = "" if backend == "eager" else f" (chạy {tool} để tạo)"
+        raise FileNotFoundError(f"Mô hình {backend} không tồn tại tại: {path}{hint}")
+
+
+class EagerClassifier:
+    """ResNet chạy bằng PyTorch eager"""
+
+    backend = "eager"
+
+    def __init__(self, model: nn.Module, device: torch.device):
+        self.model = model
+        self.device = device
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        with torch.no_grad():
+            return self.model(batch.to(self.device))
+
+
+class TorchScriptClassifier(EagerClassifier):
+    """ResNet đã trace bằng TorchScript"""
+
+    backend = "torchscript"
+
+    def __init__(self, path: str, device: torch.device):
+        model = torch.jit.load(path, map_location=device)
+        model.eval()
+        super().__init__(model, device)
+
+
+class OnnxClassifier:
+    """ResNet chạy bằng ONNX Runtime trên CPU"""
+
+    backend = "onnx"
+
+    def __init__(self, path: str):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        inputs = batch.detach().cpu().contiguous().numpy()
+        return torch.from_numpy(self.session.run(None, {self.input_name: inputs})[0])
+
+
+class Int8Classifier(TorchScriptClassifier):
+    """ResNet lượng tử hóa INT8, chỉ chạy trên CPU"""
+
+    backend = "int8"
+
+    def __init__(self, path: str, report: str, min_agreement: float):
+        # Từ chối bật INT8 nếu không có báo cáo hoặc độ trùng với FP32 quá thấp
+        if not os.path.exists(report):
+            raise FileNotFoundError(f"Thiếu báo cáo hiệu chỉnh INT8 tại: {report} (chạy quantize.py)")
+        with open(report) as f:
+            self.report = json.load(f)
+        agreement = self.report.get("top1_agreement", 0.0)
+        if agreement < min_agreement:
+            raise ValueError(
+                f"Mô hình INT8 chỉ trùng {agreement:.4f} top-1 với FP32 (< {min_agreement}), không bật"
+            )
+        torch.backends.quantized.engine = self.report["quantized_engine"]
+        super().__init__(path, torch.device("cpu"))
+
+
+def load_classifier(path: str, backend: str, num_classes: int, device: torch.device,
+                    min_agreement: float = 0.97):
+    """Tạo bộ phân loại theo backend; ``path`` là checkpoint .pth gốc"""
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {CLASSIFIER_BACKENDS})")
+    model_path = exported_path(path, backend)
+    _require(model_path, backend)
+    if backend == "eager":
+        return EagerClassifier(load_resnet_model(model_path, num_classes, device), device)
+    if backend == "torchscript":
+        return TorchScriptClassifier(model_path, device)
+    if backend == "int8":
+        return Int8Classifier(model_path, report_path(path), min_agreement)
+    return OnnxClassifier(model_path)
+
+
+def load_detector(path: str, backend: str):
+    """Tạo YOLO theo backend; ultralytics tự chọn runtime theo đuôi file"""
+    # Import khi cần để khởi động worker nhanh hơn
+    from ultralytics import YOLO
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn một trong {BACKENDS})")
+    model_path = exported_path(path, backend)
+    _require(model_path, backend)
+    return YOLO(model_path, task="detect")
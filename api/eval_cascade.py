@@ -0,0 +1,126 @@
+"""So sánh phân loại hai tầng (cascade) với cách luôn chạy ResNet ở 448.
+
+Thư mục ảnh có thể là:
+
+* có nhãn: mỗi thư mục con mang tên một lớp trong ``handler.class_names``
+  (``Healthy-Leaf/``, ``Anthracnose/``...), khi đó báo cáo thêm độ chính xác;
+* không nhãn: ảnh lá nằm trực tiếp trong thư mục, chỉ so tỉ lệ trùng với 448.
+
+Với mỗi ngưỡng độ tin cậy trong ``--thresholds``, script báo tỉ lệ lá phải
+chạy lại ở 448, thời gian/lá, độ chính xác và tỉ lệ trùng với đường cơ sở.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python eval_cascade.py --images ../leaf_crops --thresholds 0.7 0.8 0.9
+    CASCADE_ENABLED=1 CASCADE_MIN_CONFIDENCE=0.8 uvicorn main:app
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+import handler
+from handler import CASCADE_LOW_SIZE, CASCADE_MIN_MARGIN, RESNET_INPUT_SIZE, class_names
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def read_rgb(path: str) -> Optional[np.ndarray]:
+    img = cv2.imread(path)
+    return None if img is None else cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def load_dataset(folder: str) -> Tuple[List[np.ndarray], Optional[torch.Tensor]]:
+    """Đọc ảnh lá, trả về (ảnh, nhãn hoặc None nếu thư mục không chia theo lớp)"""
+    labeled = [name for name in class_names if os.path.isdir(os.path.join(folder, name))]
+    images, labels = [], []
+    if labeled:
+        for name in labeled:
+            class_dir = os.path.join(folder, name)
+            for file_name in sorted(os.listdir(class_dir)):
+                if file_name.lower().endswith(IMAGE_EXTENSIONS):
+                    img = read_rgb(os.path.join(class_dir, file_name))
+                    if img is not None:
+                        images.append(img)
+                        labels.append(class_names.index(name))
+        return images, torch.tensor(labels)
+
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            img = read_rgb(os.path.join(folder, file_name))
+            if img is not None:
+                images.append(img)
+    return images, None
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Đánh giá độ chính xác và độ trễ của phân loại hai tầng")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh lá (có thể chia thư mục con theo lớp)")
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0.6, 0.7, 0.8, 0.9],
+                        help="Các ngưỡng độ tin cậy cần thử")
+    parser.add_argument("--min-margin", type=float, default=CASCADE_MIN_MARGIN)
+    parser.add_argument("--low-size", type=int, default=CASCADE_LOW_SIZE)
+    parser.add_argument("--output", help="Ghi báo cáo JSON ra file")
+    args = parser.parse_args(argv)
+
+    images, labels = load_dataset(args.images)
+    if not images:
+        print(f"Không tìm thấy ảnh lá nào trong {args.images}")
+        return 1
+
+    handler.load_models()
+    # Chạy một lần ở cả hai kích thước để loại chi phí khởi tạo khỏi phép đo
+    handler.classify_leaves(images[:handler.RESNET_BATCH_SIZE], RESNET_INPUT_SIZE)
+    handler.classify_leaves(images[:handler.RESNET_BATCH_SIZE], args.low_size)
+
+    (base_preds, _), base_time = timed(handler.classify_leaves, images, RESNET_INPUT_SIZE)
+    rows = [{
+        "mode": f"always-{RESNET_INPUT_SIZE}",
+        "escalated_ratio": 1.0,
+        "ms_per_leaf": base_time / len(images) * 1000.0,
+        "accuracy": None if labels is None else float((base_preds == labels).float().mean()),
+        "agreement": 1.0,
+    }]
+    for threshold in args.thresholds:
+        (preds, _, escalated), elapsed = timed(
+            handler.classify_leaves_cascade, images, args.low_size, threshold, args.min_margin
+        )
+        rows.append({
+            "mode": f"cascade-{args.low_size}",
+            "min_confidence": threshold,
+            "min_margin": args.min_margin,
+            "escalated_ratio": float(escalated.float().mean()),
+            "ms_per_leaf": elapsed / len(images) * 1000.0,
+            "accuracy": None if labels is None else float((preds == labels).float().mean()),
+            "agreement": float((preds == base_preds).float().mean()),
+        })
+
+    print(f"{len(images)} lá, backend {handler.CLASSIFIER_BACKEND}")
+    print(f"{'chế độ':<14}{'ngưỡng':>8}{'chạy lại':>10}{'ms/lá':>9}{'tăng tốc':>10}{'chính xác':>11}{'trùng 448':>11}")
+    for row in rows:
+        accuracy = "-" if row["accuracy"] is None else f"{row['accuracy']:.4f}"
+        threshold = f"{row['min_confidence']:.2f}" if "min_confidence" in row else "-"
+        speedup = rows[0]["ms_per_leaf"] / row["ms_per_leaf"] if row["ms_per_leaf"] > 0 else 0.0
+        print(f"{row['mode']:<14}{threshold:>8}{row['escalated_ratio']:>10.1%}{row['ms_per_leaf']:>9.2f}"
+              f"{speedup:>9.2f}x{accuracy:>11}{row['agreement']:>11.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"leaves": len(images), "labeled": labels is not None, "results": rows}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
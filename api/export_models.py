@@ -0,0 +1,124 @@
+"""Export ResNet (pbl5_ver4.pth) và YOLO (best.pt) sang TorchScript/ONNX.
+
+Sau khi export, đầu ra của từng mô hình được so với PyTorch eager trên cùng
+một đầu vào ngẫu nhiên; script trả về mã lỗi 1 nếu sai lệch vượt ``--atol``.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python export_models.py --formats torchscript onnx
+    INFERENCE_BACKEND=onnx uvicorn main:app
+"""
+import argparse
+import inspect
+import sys
+from typing import List
+
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from engines import exported_path, load_resnet_model
+from handler import MODEL_RESNET_PATH, MODEL_YOLO_PATH, RESNET_INPUT_SIZE, YOLO_INPUT_SIZE, num_classes
+
+
+def _first_output(output):
+    return output[0] if isinstance(output, (list, tuple)) else output
+
+
+def export_resnet(fmt: str, device: torch.device) -> str:
+    model = load_resnet_model(MODEL_RESNET_PATH, num_classes, device)
+    example = torch.randn(2, 3, RESNET_INPUT_SIZE, RESNET_INPUT_SIZE, device=device)
+    path = exported_path(MODEL_RESNET_PATH, fmt)
+
+    with torch.no_grad():
+        if fmt == "torchscript":
+            traced = torch.jit.trace(model, example)
+            torch.jit.save(traced, path)
+        else:
+            kwargs = {}
+            # Dùng exporter TorchScript cổ điển trên các bản torch có exporter dynamo
+            if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+                kwargs["dynamo"] = False
+            torch.onnx.export(
+                model, example, path,
+                input_names=["input"], output_names=["logits"],
+                dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch"}},
+                opset_version=17,
+                **kwargs
+            )
+    return path
+
+
+def export_yolo(fmt: str) -> str:
+    yolo_model = YOLO(MODEL_YOLO_PATH)
+    if fmt == "onnx":
+        return yolo_model.export(format="onnx", imgsz=YOLO_INPUT_SIZE, dynamic=True)
+    return yolo_model.export(format="torchscript", imgsz=YOLO_INPUT_SIZE)
+
+
+def run_exported(path: str, fmt: str, x: torch.Tensor) -> np.ndarray:
+    if fmt == "torchscript":
+        model = torch.jit.load(path, map_location="cpu")
+        model.eval()
+        with torch.no_grad():
+            return _first_output(model(x)).numpy()
+    import onnxruntime as ort
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return session.run(None, {session.get_inputs()[0].name: x.numpy()})[0]
+
+
+def check_resnet(path: str, fmt: str, atol: float) -> bool:
+    model = load_resnet_model(MODEL_RESNET_PATH, num_classes, torch.device("cpu"))
+    ok = True
+    # Kiểm tra thêm một độ phân giải khác để chắc chắn trục động hoạt động
+    for size in (RESNET_INPUT_SIZE, 224):
+        x = torch.randn(3, 3, size, size)
+        with torch.no_grad():
+            expected = model(x).numpy()
+        actual = run_exported(path, fmt, x)
+        diff = float(np.abs(expected - actual).max())
+        same_class = bool((expected.argmax(1) == actual.argmax(1)).all())
+        print(f"  ResNet {fmt} @{size}: max |Δlogits| = {diff:.2e}, cùng lớp dự đoán: {same_class}")
+        ok = ok and diff <= atol and same_class
+    return ok
+
+
+def check_yolo(path: str, fmt: str, atol: float) -> bool:
+    model = YOLO(MODEL_YOLO_PATH).model.float().eval()
+    x = torch.rand(2, 3, YOLO_INPUT_SIZE, YOLO_INPUT_SIZE)
+    with torch.no_grad():
+        expected = _first_output(model(x)).numpy()
+    actual = run_exported(path, fmt, x)
+    diff = float(np.abs(expected - actual).max())
+    print(f"  YOLO {fmt}: max |Δoutput| = {diff:.2e}")
+    return diff <= atol
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="Export mô hình sang TorchScript/ONNX và kiểm tra sai lệch")
+    parser.add_argument("--formats", nargs="+", choices=["torchscript", "onnx"], default=["torchscript", "onnx"])
+    parser.add_argument("--models", nargs="+", choices=["resnet", "yolo"], default=["resnet", "yolo"])
+    parser.add_argument("--atol", type=float, default=1e-3, help="Sai lệch tuyệt đối tối đa so với eager")
+    args = parser.parse_args(argv)
+
+    device = torch.device("cpu")
+    all_ok = True
+    for fmt in args.formats:
+        if "resnet" in args.models:
+            path = export_resnet(fmt, device)
+            print(f"Đã export ResNet -> {path}")
+            all_ok = check_resnet(path, fmt, args.atol) and all_ok
+        if "yolo" in args.models:
+            path = export_yolo(fmt)
+            print(f"Đã export YOLO -> {path}")
+            all_ok = check_yolo(path, fmt, args.atol) and all_ok
+
+    if not all_ok:
+        print("Mô hình export sai lệch quá ngưỡng so với eager, không nên dùng")
+        return 1
+    print("Tất cả mô hình export khớp với eager trong ngưỡng cho phép")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
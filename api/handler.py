@@ -1,60 +1,161 @@
 import os
+import threading
+import time
 import cv2
 import numpy as np
 import torch
-import torch.nn as nn
-from torchvision import models, transforms
-from ultralytics import YOLO
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
+from image_processing import preprocess_leaves
+from tiling import make_tiles, merge_tile_boxes
+from budget import LeafCostEstimator, plan_leaves
+from incremental import FrameDiffTracker, skip_ratios
+from engines import load_classifier, load_detector
+from metrics import LEAVES_CLASSIFIED, LEAVES_PER_IMAGE, MODEL_LOAD_SECONDS, STAGE_SECONDS
 
 # Thiết bị
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-# Tải mô hình YOLO
+# Backend suy luận: eager, torchscript hoặc onnx (có thể chọn riêng cho từng mô hình);
+# ResNet có thêm int8 (tạo bằng quantize.py)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", INFERENCE_BACKEND)
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", INFERENCE_BACKEND)
+
+# Mô hình YOLO
 MODEL_YOLO_PATH = 'best.pt'
-if not os.path.exists(MODEL_YOLO_PATH):
-    raise FileNotFoundError(f"Mô hình YOLO không tồn tại tại: {MODEL_YOLO_PATH}")
-yolo_model = YOLO(MODEL_YOLO_PATH)
+YOLO_INPUT_SIZE = 640
+
+# Phát hiện theo ô cho khung hình độ phân giải cao: chia ảnh thành các ô TILE_SIZE
+# chồng lấn TILE_OVERLAP pixel, chạy YOLO cả batch ô rồi gộp box bằng NMS giữa các ô
+TILED_DETECTION = os.getenv("TILED_DETECTION", "0") == "1"
+TILE_SIZE = int(os.getenv("TILE_SIZE", "640"))
+TILE_OVERLAP = int(os.getenv("TILE_OVERLAP", "128"))
+TILE_NMS_IOU = float(os.getenv("TILE_NMS_IOU", "0.5"))
+# Thêm một lượt toàn khung hình để bắt các lá lớn hơn một ô
+TILE_INCLUDE_FULL_FRAME = os.getenv("TILE_INCLUDE_FULL_FRAME", "1") == "1"
 
-# Tải mô hình ResNet18
+# Mô hình ResNet18
 num_classes = 5
-resnet_model = models.resnet18(weights=None)
-for param in resnet_model.parameters():
-    param.requires_grad = False
-for param in resnet_model.layer2.parameters():
-    param.requires_grad = True
-for param in resnet_model.layer3.parameters():
-    param.requires_grad = True
-for param in resnet_model.layer4.parameters():
-    param.requires_grad = True
-
-num_ftrs = resnet_model.fc.in_features
-resnet_model.fc = nn.Sequential(
-    nn.BatchNorm1d(num_ftrs),
-    nn.Dropout(0.5),
-    nn.Linear(num_ftrs, 512),
-    nn.ReLU(),
-    nn.BatchNorm1d(512),
-    nn.Dropout(0.4),
-    nn.Linear(512, 256),
-    nn.ReLU(),
-    nn.BatchNorm1d(256),
-    nn.Dropout(0.4),
-    nn.Linear(256, num_classes)
+MODEL_RESNET_PATH = 'pbl5_ver4.pth'
+# Tỉ lệ trùng top-1 tối thiểu với FP32 để chấp nhận mô hình INT8
+QUANT_MIN_AGREEMENT = float(os.getenv("QUANT_MIN_AGREEMENT", "0.97"))
+
+# Kích thước ảnh đầu vào của ResNet
+RESNET_INPUT_SIZE = 448
+
+# Số crop tối đa cho mỗi lần chạy ResNet (giới hạn bộ nhớ khi có nhiều lá)
+RESNET_BATCH_SIZE = int(os.getenv("RESNET_BATCH_SIZE", "16"))
+
+# Phân loại hai tầng: chạy mọi lá ở CASCADE_LOW_SIZE, chỉ chạy lại ở RESNET_INPUT_SIZE
+# các lá có độ tin cậy < CASCADE_MIN_CONFIDENCE hoặc chênh lệch top-1/top-2 < CASCADE_MIN_MARGIN
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0") == "1"
+CASCADE_LOW_SIZE = int(os.getenv("CASCADE_LOW_SIZE", "224"))
+CASCADE_MIN_CONFIDENCE = float(os.getenv("CASCADE_MIN_CONFIDENCE", "0.8"))
+CASCADE_MIN_MARGIN = float(os.getenv("CASCADE_MIN_MARGIN", "0.3"))
+
+# Chế độ ngân sách độ trễ: các kích thước ResNet được phép hạ xuống (giảm dần),
+# ngưỡng để coi một lá là giá trị thấp và thời gian/lá giả định khi chưa đo được
+BUDGET_RESOLUTIONS = sorted(
+    {RESNET_INPUT_SIZE, *(int(v) for v in os.getenv("BUDGET_RESOLUTIONS", "320,224").split(",") if v)},
+    reverse=True,
 )
+BUDGET_MIN_DETECTION_CONF = float(os.getenv("BUDGET_MIN_DETECTION_CONF", "0.6"))
+BUDGET_MIN_CROP_SIZE = int(os.getenv("BUDGET_MIN_CROP_SIZE", "32"))
+leaf_cost = LeafCostEstimator(default_ms=float(os.getenv("BUDGET_DEFAULT_LEAF_MS", "25")))
 
-MODEL_RESNET_PATH = 'pbl5_ver4.pth'
-resnet_model.load_state_dict(torch.load(MODEL_RESNET_PATH, map_location=device))
-resnet_model.eval()
-resnet_model = resnet_model.to(device)
-
-# Tiền xử lý ảnh
-transform = transforms.Compose([
-    transforms.ToPILImage(),
-    transforms.Resize((448, 448)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+# Chế độ tăng dần cho camera cố định (header X-Camera-Id): so khung hình thu nhỏ với
+# khung trước để dùng lại box YOLO và chỉ phân loại lại các lá thay đổi
+camera_tracker = FrameDiffTracker(
+    diff_width=int(os.getenv("INCREMENTAL_DIFF_WIDTH", "64")),
+    pixel_threshold=int(os.getenv("INCREMENTAL_PIXEL_THRESHOLD", "12")),
+    leaf_change_fraction=float(os.getenv("INCREMENTAL_LEAF_CHANGE", "0.1")),
+    new_region_fraction=float(os.getenv("INCREMENTAL_NEW_REGION", "0.01")),
+    refresh_every=int(os.getenv("INCREMENTAL_REFRESH_FRAMES", "12")),
+)
+
+# Kích thước khung hình (cao x rộng) dùng để khởi động YOLO, mặc định UXGA của ESP32-CAM
+WARMUP_FRAME_SIZE = tuple(int(v) for v in os.getenv("WARMUP_FRAME_SIZE", "1200x1600").split("x"))
+
+# Mô hình được nạp khi cần (load_models) thay vì lúc import
+yolo_model = None
+classifier = None
+_models_lock = threading.Lock()
+model_status = {
+    "loaded": False,
+    "warmed_up": False,
+    "load_seconds": {},
+    "warmup_seconds": None,
+    "error": None,
+}
+
+def load_models():
+    """Nạp YOLO và ResNet nếu chưa nạp, an toàn khi gọi từ nhiều luồng"""
+    global yolo_model, classifier
+    if yolo_model is not None and classifier is not None:
+        return
+    with _models_lock:
+        try:
+            if yolo_model is None:
+                started = time.perf_counter()
+                yolo_model = load_detector(MODEL_YOLO_PATH, DETECTOR_BACKEND)
+                model_status["load_seconds"]["yolo"] = time.perf_counter() - started
+                MODEL_LOAD_SECONDS.set(model_status["load_seconds"]["yolo"], model="yolo")
+            if classifier is None:
+                started = time.perf_counter()
+                classifier = load_classifier(
+                    MODEL_RESNET_PATH, CLASSIFIER_BACKEND, num_classes, device, QUANT_MIN_AGREEMENT
+                )
+                model_status["load_seconds"]["resnet"] = time.perf_counter() - started
+                MODEL_LOAD_SECONDS.set(model_status["load_seconds"]["resnet"], model="resnet")
+        except Exception as e:
+            model_status["error"] = str(e)
+            raise
+        model_status["loaded"] = True
+        model_status["error"] = None
+
+def setup_detector_predictor():
+    """Dựng sẵn predictor của ultralytics cho YOLO mà không chạy suy luận
+
+    Lần predict đầu tiên ultralytics deepcopy mô hình và gộp Conv+BN thành tensor
+    mới (``AutoBackend(fuse=True)``). serve.py gọi hàm này ở tiến trình cha trước
+    khi fork để các worker dùng chung bản đã gộp qua copy-on-write, thay vì mỗi
+    worker tự dựng một bản riêng. Torch chỉ dùng 1 luồng trong lúc gộp để không
+    khởi tạo pool OpenMP trước khi fork. Bỏ qua backend onnx vì phiên onnxruntime
+    tạo luồng ngay khi mở.
+    """
+    load_models()
+    if DETECTOR_BACKEND == "onnx" or getattr(yolo_model, "predictor", None) is not None:
+        return
+    # Cùng tham số Model.predict dùng khi tạo predictor, để các lần predict sau dùng lại nó
+    args = {**yolo_model.overrides, "conf": 0.5, "batch": 1, "save": False, "mode": "predict", "rect": True}
+    threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        predictor = yolo_model._smart_load("predictor")(overrides=args, _callbacks=yolo_model.callbacks)
+        predictor.setup_model(model=yolo_model.model, verbose=False)
+    finally:
+        torch.set_num_threads(threads)
+    yolo_model.predictor = predictor
+
+def warmup():
+    """Chạy thử mô hình với dữ liệu giả để khởi tạo JIT và bộ cấp phát trước request đầu tiên"""
+    load_models()
+    started = time.perf_counter()
+    try:
+        frame = np.zeros((*WARMUP_FRAME_SIZE, 3), dtype=np.uint8)
+        yolo_model.predict(source=[frame], imgsz=YOLO_INPUT_SIZE, conf=0.5, verbose=False)
+        leaf = np.zeros((RESNET_INPUT_SIZE, RESNET_INPUT_SIZE, 3), dtype=np.uint8)
+        # Chạy đủ một batch ở mọi kích thước để có sẵn ước lượng thời gian cho chế độ ngân sách
+        warmup_sizes = set(BUDGET_RESOLUTIONS) | ({CASCADE_LOW_SIZE} if CASCADE_ENABLED else set())
+        for size in sorted(warmup_sizes, reverse=True):
+            classifier(preprocess_leaves([leaf], size))
+            classify_leaves([leaf] * RESNET_BATCH_SIZE, size)
+    except Exception as e:
+        model_status["error"] = f"Lỗi khi khởi động mô hình: {e}"
+        raise
+    model_status["warmup_seconds"] = time.perf_counter() - started
+    MODEL_LOAD_SECONDS.set(model_status["warmup_seconds"], model="warmup")
+    model_status["warmed_up"] = True
 
 # Danh sách lớp và độ ưu tiên
 class_names = ['Anthracnose', 'Bacterial-Spot', 'Downy-Mildew', 'Healthy-Leaf', 'Pest-Damage']
@@ -66,57 +167,63 @@ priority = {
     'Healthy-Leaf': 5
 }
 
-def process_leaf_image(image_path: str) -> List[Dict]:
-    """Xử lý ảnh và dự đoán bệnh lá cây"""
-    try:
-        # Đọc và chuyển đổi ảnh
-        img = cv2.imread(image_path)
-        if img is None:
-            raise Exception(f"Không thể đọc ảnh tại: {image_path}")
-        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        h, w = img.shape[:2]
-    except Exception as e:
-        raise Exception(f"Lỗi khi đọc ảnh: {e}")
+def leaf_probabilities(leaves: List[np.ndarray], size: int = RESNET_INPUT_SIZE) -> torch.Tensor:
+    """Chạy ResNet theo batch, trả về xác suất softmax (số lá x số lớp)"""
+    load_models()
+    probabilities = []
+    for start in range(0, len(leaves), RESNET_BATCH_SIZE):
+        started = time.perf_counter()
+        chunk = preprocess_leaves(leaves[start:start + RESNET_BATCH_SIZE], size)
+        preprocessed = time.perf_counter()
+        probabilities.append(torch.softmax(classifier(chunk), dim=1))
+        finished = time.perf_counter()
+        leaf_cost.update(size, len(chunk), (finished - started) * 1000.0)
+        STAGE_SECONDS.observe(preprocessed - started, stage="preprocess")
+        STAGE_SECONDS.observe(finished - preprocessed, stage="resnet")
+    return torch.cat(probabilities).cpu()
 
-    # Phát hiện lá bằng YOLO
-    results = yolo_model.predict(source=img, imgsz=640, conf=0.5)
-    boxes = results[0].boxes.xyxy.cpu().numpy()
-    confidences = results[0].boxes.conf.cpu().numpy()
+def classify_leaves(leaves: List[np.ndarray], size: int = RESNET_INPUT_SIZE) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Phân loại các lá theo batch, trả về (lớp dự đoán, độ tin cậy) của từng lá"""
+    confidences, pred_classes = leaf_probabilities(leaves, size).max(dim=1)
+    return pred_classes, confidences
 
-    if len(boxes) == 0:
-        return [{"predicted_class": "Tình trạng cây: Không phát hiện được lá", "confidence": 0.0}]
+def classify_leaves_cascade(leaves: List[np.ndarray], low_size: int = CASCADE_LOW_SIZE,
+                            min_confidence: float = CASCADE_MIN_CONFIDENCE,
+                            min_margin: float = CASCADE_MIN_MARGIN) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+    """Phân loại hai tầng, trả về (lớp dự đoán, độ tin cậy, lá nào đã chạy lại ở RESNET_INPUT_SIZE)"""
+    probabilities = leaf_probabilities(leaves, low_size)
+    top2 = probabilities.topk(min(2, probabilities.shape[1]), dim=1).values
+    margin = top2[:, 0] - top2[:, -1]
+    escalated = (top2[:, 0] < min_confidence) | (margin < min_margin)
+    if escalated.any():
+        indices = escalated.nonzero().flatten().tolist()
+        probabilities[escalated] = leaf_probabilities([leaves[i] for i in indices], RESNET_INPUT_SIZE)
+    confidences, pred_classes = probabilities.max(dim=1)
+    return pred_classes, confidences, escalated
 
-    # Dictionary để đếm tần suất và tính tổng xác suất các bệnh
-    disease_scores = {name: {"count": 0, "total_confidence": 0.0, "avg_confidence": 0.0} for name in class_names}
-    total_leaves = 0
+def aggregate_disease_scores(pred_classes: torch.Tensor, confidences: torch.Tensor) -> Dict[str, Dict]:
+    """Tính số lá, tổng và trung bình độ tin cậy cho từng bệnh"""
+    counts = torch.bincount(pred_classes, minlength=num_classes)
+    totals = torch.zeros(num_classes, dtype=torch.float64).scatter_add_(
+        0, pred_classes, confidences.to(torch.float64)
+    )
+    averages = totals / counts.clamp(min=1)
 
-    # Cắt và dự đoán từng lá
-    for i, box in enumerate(boxes):
-        x1, y1, x2, y2 = map(int, box)
-        x1, y1 = max(0, x1), max(0, y1)
-        x2, y2 = min(w, x2), min(h, y2)
-        
-        leaf = img[y1:y2, x1:x2]
-        
-        # Tiền xử lý và dự đoán
-        input_tensor = transform(leaf).unsqueeze(0).to(device)
-        with torch.no_grad():
-            output = resnet_model(input_tensor)
-            probabilities = torch.softmax(output, dim=1)
-            pred_class = torch.argmax(output, dim=1).item()
-            confidence = float(probabilities[0][pred_class])
-        
-        disease_name = class_names[pred_class]
-        disease_scores[disease_name]["count"] += 1
-        disease_scores[disease_name]["total_confidence"] += confidence
-        total_leaves += 1
-
-    # Tính trung bình xác suất cho mỗi bệnh
-    for disease in disease_scores:
-        if disease_scores[disease]["count"] > 0:
-            disease_scores[disease]["avg_confidence"] = (
-                disease_scores[disease]["total_confidence"] / disease_scores[disease]["count"]
-            )
+    return {
+        name: {
+            "count": int(counts[i]),
+            "total_confidence": float(totals[i]),
+            "avg_confidence": float(averages[i]),
+        }
+        for i, name in enumerate(class_names)
+    }
+
+def summarize_predictions(pred_classes: torch.Tensor, confidences: torch.Tensor) -> List[Dict]:
+    """Tổng hợp dự đoán của các lá thành kết quả cho cả cây"""
+    total_leaves = len(pred_classes)
+
+    # Đếm tần suất và tính xác suất trung bình của từng bệnh
+    disease_scores = aggregate_disease_scores(pred_classes, confidences)
 
     # Tìm bệnh có độ ưu tiên cao nhất trong các bệnh được phát hiện
     detected_diseases = [disease for disease in disease_scores if disease_scores[disease]["count"] > 0]
@@ -133,4 +240,276 @@ def process_leaf_image(image_path: str) -> List[Dict]:
         "details": f"Phát hiện {disease_scores[highest_priority_disease]['count']} trên tổng số {total_leaves} lá"
     }
 
-    return [result]
\ No newline at end of file
+    return [result]
+
+def crop_leaves(img: np.ndarray, boxes: np.ndarray) -> List[np.ndarray]:
+    """Cắt các lá theo bounding box"""
+    h, w = img.shape[:2]
+    leaves = []
+    for box in boxes:
+        x1, y1, x2, y2 = map(int, box)
+        x1, y1 = max(0, x1), max(0, y1)
+        x2, y2 = min(w, x2), min(h, y2)
+        leaves.append(img[y1:y2, x1:x2])
+    return leaves
+
+def load_image(image_path: str) -> np.ndarray:
+    """Đọc ảnh từ file và chuyển sang RGB"""
+    try:
+        img = cv2.imread(image_path)
+        if img is None:
+            raise Exception(f"Không thể đọc ảnh tại: {image_path}")
+        return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    except Exception as e:
+        raise Exception(f"Lỗi khi đọc ảnh: {e}")
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Giải mã ảnh trực tiếp từ bytes trong bộ nhớ và chuyển sang RGB"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise Exception("Lỗi khi đọc ảnh: dữ liệu không phải ảnh hợp lệ")
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def detect_leaves_tiled(images: List[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray], List[Dict]]:
+    """Phát hiện lá theo ô: mọi ô của mọi ảnh chạy YOLO trong một batch"""
+    tiles, owners, offsets = [], [], []
+    for index, img in enumerate(images):
+        h, w = img.shape[:2]
+        for x1, y1, x2, y2 in make_tiles(h, w, TILE_SIZE, TILE_OVERLAP):
+            tiles.append(img[y1:y2, x1:x2])
+            owners.append(index)
+            offsets.append((x1, y1))
+
+    started = time.perf_counter()
+    results = yolo_model.predict(source=tiles, imgsz=TILE_SIZE, conf=0.5)
+    detect_ms = (time.perf_counter() - started) * 1000.0
+
+    full_results = [None] * len(images)
+    full_ms = 0.0
+    if TILE_INCLUDE_FULL_FRAME:
+        started = time.perf_counter()
+        full_results = yolo_model.predict(source=list(images), imgsz=YOLO_INPUT_SIZE, conf=0.5)
+        full_ms = (time.perf_counter() - started) * 1000.0
+
+    all_boxes, all_scores, infos = [], [], []
+    for index in range(len(images)):
+        tile_ids = [i for i, owner in enumerate(owners) if owner == index]
+        boxes, scores = [], []
+        for i in tile_ids:
+            x_offset, y_offset = offsets[i]
+            boxes.append(results[i].boxes.xyxy.cpu().numpy() + np.array([x_offset, y_offset, x_offset, y_offset]))
+            scores.append(results[i].boxes.conf.cpu().numpy())
+        if full_results[index] is not None:
+            boxes.append(full_results[index].boxes.xyxy.cpu().numpy())
+            scores.append(full_results[index].boxes.conf.cpu().numpy())
+        boxes = np.concatenate(boxes).reshape(-1, 4)
+        scores = np.concatenate(scores)
+
+        started = time.perf_counter()
+        keep = merge_tile_boxes(boxes, scores, TILE_NMS_IOU)
+        merge_ms = (time.perf_counter() - started) * 1000.0
+
+        all_boxes.append(boxes[keep])
+        all_scores.append(scores[keep])
+        infos.append({
+            "tiles": len(tile_ids),
+            "tile_size": TILE_SIZE,
+            "overlap": TILE_OVERLAP,
+            # Thời gian thực của batch ô chia đều cho mỗi ô, và tổng thời gian ultralytics
+            # đo (preprocess + inference + postprocess) trên mọi ô của ảnh này
+            "detect_ms_per_tile": round(detect_ms / len(tiles), 2),
+            "tile_inference_ms": round(sum(sum(results[i].speed.values()) for i in tile_ids), 2),
+            "full_frame_ms": round(full_ms / len(images), 2),
+            "boxes_before_merge": int(len(boxes)),
+            "boxes_after_merge": int(len(keep)),
+            "merge_ms": round(merge_ms, 2),
+        })
+    return all_boxes, all_scores, infos
+
+def detect_leaves(images: List[np.ndarray]) -> Tuple[List[np.ndarray], List[np.ndarray], List[Optional[Dict]]]:
+    """Phát hiện lá trên cả batch ảnh, trả về box, độ tin cậy của từng ảnh và thông tin chia ô (nếu có)"""
+    if TILED_DETECTION:
+        return detect_leaves_tiled(images)
+    results = yolo_model.predict(source=list(images), imgsz=YOLO_INPUT_SIZE, conf=0.5)
+    return (
+        [result.boxes.xyxy.cpu().numpy() for result in results],
+        [result.boxes.conf.cpu().numpy() for result in results],
+        [None] * len(images),
+    )
+
+def plan_classification(all_boxes: List[np.ndarray], all_scores: List[np.ndarray],
+                        deadlines: List[Optional[float]]) -> List[Tuple[np.ndarray, int, Optional[Dict]]]:
+    """Chọn lá và kích thước ResNet cho từng ảnh, trả về (chỉ số lá, kích thước, thông tin ngân sách)
+
+    Mọi lá của batch được phân loại chung nên kết quả của từng ảnh chỉ có khi
+    cả batch xong: thời gian của các ảnh đã lập kế hoạch trước được trừ vào
+    ngân sách của ảnh sau. Ảnh không có hạn chót được xử lý đầy đủ.
+    """
+    now = time.monotonic()
+    plans: List[Optional[Tuple[np.ndarray, int, Optional[Dict]]]] = [None] * len(all_boxes)
+    committed_ms = 0.0
+    for i, deadline in enumerate(deadlines):
+        if deadline is None:
+            plans[i] = (np.arange(len(all_boxes[i])), RESNET_INPUT_SIZE, None)
+            committed_ms += len(all_boxes[i]) * leaf_cost.ms_per_leaf(RESNET_INPUT_SIZE)
+
+    # Ảnh có hạn chót sớm hơn được ưu tiên
+    budgeted = sorted((i for i, deadline in enumerate(deadlines) if deadline is not None), key=lambda i: deadlines[i])
+    for i in budgeted:
+        boxes = all_boxes[i].reshape(-1, 4)
+        remaining_ms = (deadlines[i] - now) * 1000.0
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        keep, size, degradations = plan_leaves(
+            all_scores[i], areas, remaining_ms - committed_ms, leaf_cost,
+            BUDGET_RESOLUTIONS, BUDGET_MIN_DETECTION_CONF, BUDGET_MIN_CROP_SIZE ** 2
+        )
+        committed_ms += len(keep) * leaf_cost.ms_per_leaf(size)
+        plans[i] = (keep, size, {
+            "remaining_ms_after_detection": round(remaining_ms, 1),
+            "detected_leaves": int(len(boxes)),
+            "classified_leaves": int(len(keep)),
+            "input_size": int(size),
+            "degradations": degradations,
+        })
+    return plans
+
+def process_leaf_batch(images: List[np.ndarray], deadlines: Optional[List[Optional[float]]] = None) -> List[List[Dict]]:
+    """Xử lý nhiều ảnh RGB cùng lúc: một lần YOLO và một batch ResNet cho mọi lá
+
+    ``deadlines`` (time.monotonic(), None nếu không giới hạn) bật chế độ ngân
+    sách độ trễ cho từng ảnh, xem ``plan_classification``.
+    """
+    load_models()
+    deadlines = deadlines or [None] * len(images)
+
+    # Phát hiện lá bằng YOLO cho cả batch ảnh
+    with STAGE_SECONDS.time(stage="yolo"):
+        all_boxes, all_scores, tiling_infos = detect_leaves(images)
+    for boxes in all_boxes:
+        LEAVES_PER_IMAGE.observe(len(boxes))
+    plans = plan_classification(all_boxes, all_scores, deadlines)
+
+    # Cắt lá của tất cả ảnh, gom theo kích thước đầu vào ResNet
+    leaves_by_size: Dict[int, List[np.ndarray]] = {}
+    slots, leaf_counts = [], []
+    with STAGE_SECONDS.time(stage="crop"):
+        for img, boxes, (keep, size, _) in zip(images, all_boxes, plans):
+            image_leaves = crop_leaves(img, boxes[keep])
+            group = leaves_by_size.setdefault(size, [])
+            slots.append((size, len(group)))
+            group.extend(image_leaves)
+            leaf_counts.append(len(image_leaves))
+
+    # Dự đoán toàn bộ lá theo batch, mỗi kích thước một lượt; kích thước đầy đủ dùng
+    # phân loại hai tầng nếu bật
+    predictions, escalated = {}, None
+    for size, group in leaves_by_size.items():
+        if not group:
+            continue
+        if CASCADE_ENABLED and size == RESNET_INPUT_SIZE:
+            pred_classes, leaf_confidences, escalated = classify_leaves_cascade(group)
+            predictions[size] = (pred_classes, leaf_confidences)
+        else:
+            predictions[size] = classify_leaves(group, size)
+    for pred_classes, _ in predictions.values():
+        count_classified(pred_classes)
+
+    aggregate_started = time.perf_counter()
+    outputs = []
+    for i, count in enumerate(leaf_counts):
+        if count == 0:
+            outputs.append([{"predicted_class": "Tình trạng cây: Không phát hiện được lá", "confidence": 0.0}])
+        else:
+            size, start = slots[i]
+            pred_classes, leaf_confidences = predictions[size]
+            outputs.append(summarize_predictions(
+                pred_classes[start:start + count], leaf_confidences[start:start + count]
+            ))
+        if escalated is not None and count and slots[i][0] == RESNET_INPUT_SIZE:
+            start = slots[i][1]
+            outputs[i][0]["cascade"] = {
+                "low_size": CASCADE_LOW_SIZE,
+                "leaves": count,
+                "escalated": int(escalated[start:start + count].sum()),
+            }
+        if tiling_infos[i] is not None:
+            outputs[i][0]["tiling"] = tiling_infos[i]
+        if plans[i][2] is not None:
+            outputs[i][0]["budget"] = plans[i][2]
+    STAGE_SECONDS.observe(time.perf_counter() - aggregate_started, stage="aggregate")
+    return outputs
+
+def process_camera_frame(img: np.ndarray, camera_id: str) -> List[Dict]:
+    """Xử lý khung hình của camera cố định, dùng lại box và dự đoán của khung trước khi được"""
+    load_models()
+    state = camera_tracker.camera(camera_id)
+    with state.lock:
+        small = camera_tracker.downscale(img)
+        mode, detail = camera_tracker.plan(state, img, small)
+        if mode == "full":
+            with STAGE_SECONDS.time(stage="yolo"):
+                boxes = detect_leaves([img])[0][0].reshape(-1, 4)
+            reclassify = np.arange(len(boxes))
+            pred_classes = torch.zeros(len(boxes), dtype=torch.long)
+            confidences = torch.zeros(len(boxes))
+        else:
+            boxes = state.boxes
+            reclassify = np.flatnonzero(detail)
+            pred_classes, confidences = state.pred_classes.clone(), state.confidences.clone()
+
+        if len(reclassify):
+            with STAGE_SECONDS.time(stage="crop"):
+                leaves = crop_leaves(img, boxes[reclassify])
+            new_classes, new_confidences = classify_leaves(leaves)
+            index = torch.from_numpy(reclassify)
+            pred_classes[index] = new_classes
+            confidences[index] = new_confidences.to(confidences.dtype)
+            count_classified(new_classes)
+        LEAVES_PER_IMAGE.observe(len(boxes))
+
+        camera_tracker.record(state, img, small, boxes, pred_classes, confidences,
+                              full=mode == "full", reused=len(boxes) - len(reclassify))
+        info = {
+            "camera_id": camera_id,
+            "mode": mode,
+            "reason": detail if mode == "full" else "frame_diff",
+            "leaves": int(len(boxes)),
+            "reclassified": int(len(reclassify)),
+            **skip_ratios(state),
+        }
+
+    if len(boxes) == 0:
+        outputs = [{"predicted_class": "Tình trạng cây: Không phát hiện được lá", "confidence": 0.0}]
+    else:
+        outputs = summarize_predictions(pred_classes, confidences)
+    outputs[0]["incremental"] = info
+    return outputs
+
+def count_classified(pred_classes: torch.Tensor):
+    for class_index, count in enumerate(torch.bincount(pred_classes, minlength=num_classes).tolist()):
+        if count:
+            LEAVES_CLASSIFIED.inc(count, class_name=class_names[class_index])
+
+def process_leaf_jobs(jobs: List[Tuple[np.ndarray, Optional[float], Optional[str]]]) -> List[List[Dict]]:
+    """Như process_leaf_batch cho các mục (ảnh, hạn chót, mã camera) lấy từ scheduler
+
+    Ảnh có mã camera đi theo chế độ tăng dần, lần lượt theo thứ tự đến.
+    """
+    outputs: List[Optional[List[Dict]]] = [None] * len(jobs)
+    plain = [i for i, (_, _, camera_id) in enumerate(jobs) if camera_id is None]
+    if plain:
+        results = process_leaf_batch([jobs[i][0] for i in plain], [jobs[i][1] for i in plain])
+        for i, result in zip(plain, results):
+            outputs[i] = result
+    for i, (img, _, camera_id) in enumerate(jobs):
+        if camera_id is not None:
+            outputs[i] = process_camera_frame(img, camera_id)
+    return outputs
+
+def process_leaf_array(img: np.ndarray) -> List[Dict]:
+    """Dự đoán bệnh lá cây cho ảnh RGB đã giải mã sẵn"""
+    return process_leaf_batch([img])[0]
+
+def process_leaf_image(image_path: str) -> List[Dict]:
+    """Xử lý ảnh và dự đoán bệnh lá cây"""
+    return process_leaf_array(load_image(image_path))
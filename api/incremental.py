@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+
+
+class CameraState:
+    """Khung hình thu nhỏ, box và dự đoán từng lá của lần xử lý gần nhất"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.small: Optional[np.ndarray] = None
+        self.shape: Optional[Tuple[int, int]] = None
+        self.boxes: Optional[np.ndarray] = None
+        self.pred_classes: Optional[torch.Tensor] = None
+        self.confidences: Optional[torch.Tensor] = None
+        self.frames_since_refresh = 0
+        self.frames = 0
+        self.detections_skipped = 0
+        self.leaves_seen = 0
+        self.leaves_reused = 0
+
+
+class FrameDiffTracker:
+    """Quyết định cho từng camera cố định: chạy lại YOLO hay dùng lại box cũ.
+
+    Khung hình được thu nhỏ về ảnh xám rộng ``diff_width`` pixel và so với
+    khung trước. Chạy phát hiện đầy đủ khi chưa có khung trước, kích thước
+    đổi, đã dùng lại box ``refresh_every`` khung liên tiếp, hoặc phần thay
+    đổi nằm ngoài các box cũ vượt ``new_region_fraction`` diện tích (lá mới
+    hoặc lá đã dịch chuyển). Ngược lại chỉ phân loại lại các lá có hơn
+    ``leaf_change_fraction`` diện tích box bị thay đổi.
+    """
+
+    def __init__(self, diff_width: int = 64, pixel_threshold: int = 12,
+                 leaf_change_fraction: float = 0.1, new_region_fraction: float = 0.01,
+                 refresh_every: int = 12, max_cameras: int = 64):
+        self.diff_width = diff_width
+        self.pixel_threshold = pixel_threshold
+        self.leaf_change_fraction = leaf_change_fraction
+        self.new_region_fraction = new_region_fraction
+        self.refresh_every = max(1, refresh_every)
+        self.max_cameras = max_cameras
+        self._cameras: "OrderedDict[str, CameraState]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def camera(self, camera_id: str) -> CameraState:
+        with self._lock:
+            state = self._cameras.get(camera_id)
+            if state is None:
+                state = self._cameras[camera_id] = CameraState()
+                while len(self._cameras) > self.max_cameras:
+                    self._cameras.popitem(last=False)
+            else:
+                self._cameras.move_to_end(camera_id)
+            return state
+
+    def downscale(self, img: np.ndarray) -> np.ndarray:
+        h, w = img.shape[:2]
+        size = (self.diff_width, max(1, round(h * self.diff_width / w)))
+        return cv2.resize(cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), size, interpolation=cv2.INTER_AREA)
+
+    def plan(self, state: CameraState, img: np.ndarray, small: np.ndarray) -> Tuple[str, Optional[np.ndarray]]:
+        """Trả về ("full", lý do) hoặc ("reuse", mảng bool các lá cần phân loại lại)"""
+        if state.small is None:
+            return "full", "first_frame"
+        if state.shape != img.shape[:2]:
+            return "full", "frame_size_changed"
+        if state.frames_since_refresh + 1 >= self.refresh_every:
+            return "full", "forced_refresh"
+
+        changed = cv2.absdiff(small, state.small) > self.pixel_threshold
+        scale = small.shape[1] / img.shape[1]
+        covered = np.zeros_like(changed)
+        leaf_changed = np.zeros(len(state.boxes), dtype=bool)
+        for i, box in enumerate(state.boxes):
+            x1, y1, x2, y2 = (box * scale).astype(int)
+            x2, y2 = max(x2, x1 + 1), max(y2, y1 + 1)
+            region = changed[y1:y2, x1:x2]
+            covered[y1:y2, x1:x2] = True
+            leaf_changed[i] = region.size > 0 and region.mean() > self.leaf_change_fraction
+
+        if (changed & ~covered).mean() > self.new_region_fraction:
+            return "full", "new_region_changed"
+        return "reuse", leaf_changed
+
+    def record(self, state: CameraState, img: np.ndarray, small: np.ndarray, boxes: np.ndarray,
+               pred_classes: torch.Tensor, confidences: torch.Tensor, full: bool, reused: int):
+        state.small = small
+        state.shape = img.shape[:2]
+        state.boxes = boxes
+        state.pred_classes = pred_classes
+        state.confidences = confidences
+        state.frames += 1
+        state.frames_since_refresh = 0 if full else state.frames_since_refresh + 1
+        state.detections_skipped += 0 if full else 1
+        state.leaves_seen += len(boxes)
+        state.leaves_reused += reused
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            cameras = list(self._cameras.items())
+        return {camera_id: skip_ratios(state) for camera_id, state in cameras}
+
+
+def skip_ratios(state: CameraState) -> Dict:
+    return {
+        "frames": state.frames,
+        "detection_skip_ratio": state.detections_skipped / state.frames if state.frames else 0.0,
+        "leaf_skip_ratio": state.leaves_reused / state.leaves_seen if state.leaves_seen else 0.0,
+    }
@@ -1,50 +1,314 @@
 
-from fastapi import FastAPI, UploadFile, File, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+import asyncio
+import json
 import os
-from handler import process_leaf_image
+import time
+import uuid
+from contextlib import asynccontextmanager
+import threading
+import cpu_tuning
+import handler
+from handler import decode_image, process_leaf_jobs
+from scheduler import InferenceScheduler, QueueFullError
+from cache import PredictionCache, content_hash, perceptual_hash
+from archives import is_archive, iter_archive_images
+from metrics import ERRORS, IN_FLIGHT, QUEUE_DEPTH, REGISTRY, REQUEST_SECONDS, STAGE_SECONDS
 from pydantic import BaseModel
-from typing import List, Dict
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 
-app = FastAPI()
+# Gom các request /predict đồng thời thành batch cho YOLO và ResNet
+SCHEDULER_MAX_BATCH_SIZE = int(os.getenv("SCHEDULER_MAX_BATCH_SIZE", "8"))
+SCHEDULER_MAX_WAIT_MS = float(os.getenv("SCHEDULER_MAX_WAIT_MS", "10"))
+# Số luồng chạy mô hình và giới hạn hàng đợi; quá giới hạn thì trả 503 ngay
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "64"))
+scheduler = InferenceScheduler(
+    process_leaf_jobs,
+    max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+    max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+    num_workers=INFERENCE_WORKERS,
+    max_queue_size=INFERENCE_QUEUE_SIZE,
+)
 
-# Thư mục lưu ảnh upload
+# Cache kết quả cho các khung hình lặp lại; PREDICTION_CACHE_SIZE=0 để tắt,
+# PREDICTION_CACHE_PHASH_DISTANCE >= 0 để bật khớp gần đúng theo dHash
+prediction_cache = PredictionCache(
+    max_entries=int(os.getenv("PREDICTION_CACHE_SIZE", "256")),
+    ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL", "60")),
+    phash_distance=int(os.getenv("PREDICTION_CACHE_PHASH_DISTANCE", "-1")),
+)
+
+# Mô hình luôn được nạp trong nền khi worker bắt đầu; WARMUP_ON_STARTUP=1 chạy thêm
+# bước khởi động. /health/ready báo khi xong
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") == "1"
+
+def prepare_models():
+    try:
+        handler.load_models()
+        if WARMUP_ON_STARTUP:
+            handler.warmup()
+    except Exception as e:
+        print(f"Không thể nạp hoặc khởi động mô hình: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Đặt số luồng torch/ghim CPU trước khi luồng suy luận nào chạy
+    cpu_settings = cpu_tuning.apply_cpu_profile(
+        int(os.getenv("API_WORKER_INDEX", "0")), int(os.getenv("API_WORKERS", "1"))
+    )
+    print(f"Cấu hình CPU (pid {os.getpid()}): {cpu_settings}")
+    scheduler.start()
+    threading.Thread(target=prepare_models, name="model-warmup", daemon=True).start()
+    yield
+    scheduler.stop()
+
+app = FastAPI(lifespan=lifespan)
+
+# Số ảnh của một request /predict/batch được đưa vào scheduler cùng lúc
+BATCH_MAX_IN_FLIGHT = int(os.getenv("BATCH_MAX_IN_FLIGHT", str(2 * SCHEDULER_MAX_BATCH_SIZE)))
+
+# Chỉ lưu ảnh upload ra đĩa khi cần debug
+DEBUG_SAVE_UPLOADS = os.getenv("DEBUG_SAVE_UPLOADS", "0") == "1"
 UPLOAD_DIR = "uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+if DEBUG_SAVE_UPLOADS:
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+def save_debug_upload(filename: str, data: bytes) -> str:
+    """Lưu ảnh upload với tên duy nhất để tránh trùng tên giữa các client"""
+    ext = os.path.splitext(filename or "")[1] or ".jpg"
+    file_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{ext}")
+    with STAGE_SECONDS.time(stage="debug_save"), open(file_path, "wb") as f:
+        f.write(data)
+    return file_path
 
 class PredictionResult(BaseModel):
     leaf_index: int
     predicted_class: str
     confidence: float
+    tiling: Optional[Dict[str, Any]] = None
+    budget: Optional[Dict[str, Any]] = None
+    cascade: Optional[Dict[str, Any]] = None
+    incremental: Optional[Dict[str, Any]] = None
+
+def to_prediction_results(results: List[Dict]) -> List[PredictionResult]:
+    return [
+        PredictionResult(
+            leaf_index=i+1,
+            predicted_class=result["predicted_class"],
+            confidence=result["confidence"],
+            tiling=result.get("tiling"),
+            budget=result.get("budget"),
+            cascade=result.get("cascade"),
+            incremental=result.get("incremental")
+        )
+        for i, result in enumerate(results)
+    ]
+
+def decode_with_hash(data: bytes, with_phash: bool):
+    with STAGE_SECONDS.time(stage="decode"):
+        img = decode_image(data)
+    return img, perceptual_hash(img) if with_phash else None
+
+async def predict_image(data: bytes, use_cache: bool = True, deadline: Optional[float] = None,
+                        camera_id: Optional[str] = None) -> Tuple[List[Dict], str]:
+    """Dự đoán cho một ảnh, trả về (kết quả, trạng thái cache HIT/NEAR/MISS/BYPASS)
+
+    ``deadline`` (time.monotonic()) bật chế độ ngân sách độ trễ; kết quả đã bị
+    giảm chất lượng thì không được lưu vào cache. ``camera_id`` bật chế độ
+    tăng dần theo camera, thay cho cache.
+    """
+    use_cache = use_cache and prediction_cache.enabled and camera_id is None
+    key = None
+    if use_cache:
+        key = content_hash(data)
+        cached = prediction_cache.get(key)
+        if cached is not None:
+            return cached, "HIT"
+
+    # Giải mã và suy luận đều chạy ngoài event loop
+    with_phash = use_cache and prediction_cache.near_duplicates_enabled
+    img, phash = await run_in_threadpool(decode_with_hash, data, with_phash)
+    if phash is not None:
+        similar = prediction_cache.get_similar(phash)
+        if similar is not None:
+            return similar, "NEAR"
+
+    if use_cache:
+        prediction_cache.record_miss()
+    results = await asyncio.wrap_future(scheduler.submit((img, deadline, camera_id)))
+    degraded = bool(results and results[0].get("budget", {}).get("degradations"))
+    if key is not None and not degraded:
+        prediction_cache.put(key, results, phash)
+    return results, "MISS" if use_cache else "BYPASS"
+
+@app.post("/predict", response_model=List[PredictionResult], response_model_exclude_none=True)
+async def predict_leaves(
+    response: Response,
+    file: UploadFile = File(...),
+    x_cache_bypass: Optional[str] = Header(None),
+    x_latency_budget_ms: Optional[float] = Header(None, gt=0),
+    x_camera_id: Optional[str] = Header(None),
+    budget_ms: Optional[float] = Query(None, gt=0)
+):
+    # Ngân sách độ trễ tính từ lúc nhận request (query ưu tiên hơn header X-Latency-Budget-Ms)
+    budget = budget_ms or x_latency_budget_ms
+    deadline = time.monotonic() + budget / 1000.0 if budget else None
 
-@app.post("/predict", response_model=List[PredictionResult])
-async def predict_leaves(file: UploadFile = File(...)):
     # Kiểm tra loại file
     if not file.content_type.startswith("image/"):
+        ERRORS.inc(endpoint="/predict", type="invalid_content_type")
         raise HTTPException(status_code=400, detail="File phải là ảnh")
-    
-    # Lưu file tạm thời
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as f:
-        f.write(await file.read())
-    
-    try:
-        # Gọi hàm xử lý từ handler
-        results = process_leaf_image(file_path)
-        return [
-            PredictionResult(
-                leaf_index=i+1,
-                predicted_class=result["predicted_class"],
-                confidence=result["confidence"]
+
+    with IN_FLIGHT.track_inprogress(endpoint="/predict"), REQUEST_SECONDS.time(endpoint="/predict"):
+        # Đọc ảnh trực tiếp trong bộ nhớ
+        data = await file.read()
+        if DEBUG_SAVE_UPLOADS:
+            await run_in_threadpool(save_debug_upload, file.filename, data)
+
+        try:
+            # Header X-Cache-Bypass: 1 buộc chạy lại mô hình
+            use_cache = x_cache_bypass not in ("1", "true", "yes")
+            # Header X-Camera-Id: chế độ tăng dần cho camera cố định gửi ảnh định kỳ
+            results, cache_status = await predict_image(data, use_cache, deadline, x_camera_id)
+            response.headers["X-Cache"] = cache_status
+            return to_prediction_results(results)
+        except QueueFullError as e:
+            ERRORS.inc(endpoint="/predict", type="queue_full")
+            raise HTTPException(
+                status_code=503,
+                detail="Máy chủ đang quá tải, vui lòng thử lại sau",
+                headers={"Retry-After": str(e.retry_after)}
             )
-            for i, result in enumerate(results)
-        ]
+        except Exception as e:
+            ERRORS.inc(endpoint="/predict", type=type(e).__name__)
+            raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
+
+def is_batch_file(file: UploadFile) -> bool:
+    return is_archive(file.filename, file.content_type) or (file.content_type or "").startswith("image/")
+
+async def iter_file_images(file: UploadFile) -> AsyncIterator[Tuple[str, bytes]]:
+    """Duyệt ảnh của một file upload; file zip/tar được đọc lần lượt từng ảnh"""
+    if is_archive(file.filename, file.content_type):
+        entries = iter_archive_images(file.file, file.filename)
+        while True:
+            entry = await run_in_threadpool(next, entries, None)
+            if entry is None:
+                break
+            yield entry
+    else:
+        yield file.filename, await file.read()
+
+async def predict_with_retry(data: bytes, use_cache: bool) -> Tuple[List[Dict], str]:
+    """Như predict_image nhưng chờ và thử lại khi hàng đợi đầy thay vì báo lỗi"""
+    while True:
+        try:
+            return await predict_image(data, use_cache)
+        except QueueFullError as e:
+            await asyncio.sleep(min(e.retry_after, 1.0))
+
+async def predict_batch_item(index: int, filename: str, data: bytes, use_cache: bool) -> Dict:
+    try:
+        with IN_FLIGHT.track_inprogress(endpoint="/predict/batch"), REQUEST_SECONDS.time(endpoint="/predict/batch"):
+            results, cache_status = await predict_with_retry(data, use_cache)
+        return {
+            "index": index,
+            "filename": filename,
+            "status": "ok",
+            "cache": cache_status,
+            "results": jsonable_encoder(to_prediction_results(results), exclude_none=True),
+        }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Lỗi xử lý: {str(e)}")
+        ERRORS.inc(endpoint="/predict/batch", type=type(e).__name__)
+        return {"index": index, "filename": filename, "status": "error", "error": f"Lỗi xử lý: {str(e)}"}
+
+async def stream_batch_results(files: List[UploadFile], use_cache: bool) -> AsyncIterator[str]:
+    """Sinh một dòng NDJSON cho mỗi ảnh ngay khi ảnh đó xử lý xong
+
+    File nén hỏng giữa chừng chỉ sinh một dòng lỗi cho file đó; các ảnh đã
+    gửi đi và các file sau vẫn được xử lý tiếp.
+    """
+    tasks = set()
+
+    def finished_lines(done):
+        return [json.dumps(task.result(), ensure_ascii=False) + "\n" for task in done]
+
+    try:
+        index = 0
+        for file in files:
+            try:
+                async for filename, data in iter_file_images(file):
+                    # Giữ tối đa BATCH_MAX_IN_FLIGHT ảnh đang chờ để scheduler gom batch
+                    while len(tasks) >= BATCH_MAX_IN_FLIGHT:
+                        done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                        for line in finished_lines(done):
+                            yield line
+                    tasks.add(asyncio.create_task(predict_batch_item(index, filename, data, use_cache)))
+                    index += 1
+
+                    done = {task for task in tasks if task.done()}
+                    tasks -= done
+                    for line in finished_lines(done):
+                        yield line
+            except Exception as e:
+                ERRORS.inc(endpoint="/predict/batch", type="invalid_file")
+                yield json.dumps(
+                    {"filename": file.filename, "status": "error", "error": str(e)},
+                    ensure_ascii=False,
+                ) + "\n"
+
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for line in finished_lines(done):
+                yield line
     finally:
-        # Xóa file tạm thời
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Client ngắt kết nối: hủy các ảnh còn đang chờ
+        for task in tasks:
+            task.cancel()
+
+@app.post("/predict/batch")
+async def predict_batch(
+    files: List[UploadFile] = File(...),
+    x_cache_bypass: Optional[str] = Header(None)
+):
+    """Dự đoán nhiều ảnh (hoặc file zip/tar chứa ảnh), trả kết quả dạng NDJSON theo thứ tự xử lý xong"""
+    # Kiểm tra loại mọi file trước khi gửi ảnh nào đi
+    invalid = [file.filename for file in files if not is_batch_file(file)]
+    if invalid:
+        ERRORS.inc(endpoint="/predict/batch", type="invalid_content_type")
+        raise HTTPException(status_code=400, detail=f"File không phải ảnh hoặc file nén zip/tar: {', '.join(invalid)}")
+    use_cache = x_cache_bypass not in ("1", "true", "yes")
+    return StreamingResponse(stream_batch_results(files, use_cache), media_type="application/x-ndjson")
+
+@app.get("/stats")
+async def get_stats():
+    """Độ sâu hàng đợi, thời gian chờ, số request bị từ chối, thống kê cache và tỉ lệ bỏ qua theo camera"""
+    return {
+        **scheduler.stats(),
+        "cache": prediction_cache.stats(),
+        "incremental": handler.camera_tracker.stats(),
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Số đo theo định dạng văn bản của Prometheus"""
+    QUEUE_DEPTH.set(scheduler.stats()["queue_depth"])
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+async def health_live():
+    """Tiến trình còn sống và event loop còn phản hồi"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def health_ready():
+    """Chỉ sẵn sàng nhận traffic khi mô hình đã nạp và khởi động xong"""
+    ready = handler.model_status["loaded"] and (handler.model_status["warmed_up"] or not WARMUP_ON_STARTUP)
+    body = {"status": "ready" if ready else "not_ready", **handler.model_status}
+    return JSONResponse(status_code=200 if ready else 503, content=body)
 
 @app.get("/")
 async def root():
@@ -0,0 +1,153 @@
+"""Đo bộ nhớ và thông lượng của serve.py với 1, 2, 4 và 8 worker.
+
+Với mỗi số worker, script khởi động ``serve.py``, chờ API sẵn sàng, đo RSS
+và PSS (bộ nhớ chia sẻ được chia đều cho các tiến trình, đọc từ
+``/proc/<pid>/smaps_rollup``) của tiến trình cha và từng worker, rồi gửi
+ảnh đồng thời tới ``/predict`` (bỏ qua cache) trong một khoảng thời gian để
+tính số ảnh/giây.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python measure_workers.py --image ../test.jpg --duration 30 --json-out workers.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List
+
+import requests
+
+
+def read_memory_kb(pid: int) -> Dict[str, int]:
+    """Đọc RSS và PSS (kB) của một tiến trình"""
+    memory = {"rss_kb": 0, "pss_kb": 0}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                if key == "Rss":
+                    memory["rss_kb"] = int(value.split()[0])
+                elif key == "Pss":
+                    memory["pss_kb"] = int(value.split()[0])
+    except FileNotFoundError:
+        pass
+    return memory
+
+
+def child_pids(pid: int) -> List[int]:
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(p) for p in f.read().split()]
+    except FileNotFoundError:
+        return []
+
+
+def wait_until_ready(url: str, workers: int, timeout: float = 120.0):
+    """Chờ ``url`` (/health/ready) trả 200 liên tiếp đủ nhiều lần
+
+    Mỗi lần hỏi mở kết nối mới nên có thể rơi vào worker bất kỳ; cần
+    ``3 * workers`` lần liên tiếp để gần như chắc mọi worker đã nạp mô hình.
+    """
+    deadline = time.monotonic() + timeout
+    streak = 0
+    while time.monotonic() < deadline:
+        try:
+            ok = requests.get(url, timeout=1).status_code == 200
+        except requests.exceptions.RequestException:
+            ok = False
+        streak = streak + 1 if ok else 0
+        if streak >= 3 * workers:
+            return
+        time.sleep(0.1 if ok else 0.5)
+    raise TimeoutError(f"API không sẵn sàng sau {timeout}s")
+
+
+def run_load(url: str, image: bytes, concurrency: int, duration: float) -> Dict[str, float]:
+    """Gửi ảnh liên tục từ ``concurrency`` luồng trong ``duration`` giây"""
+    counts = {"ok": 0, "error": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def worker():
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            try:
+                # Luôn gửi cùng một ảnh nên phải bỏ qua cache, nếu không chỉ đo được cache hit
+                r = session.post(url, files={"file": ("bench.jpg", image, "image/jpeg")},
+                                 headers={"X-Cache-Bypass": "1"}, timeout=120)
+                key = "ok" if r.status_code == 200 else "error"
+            except requests.exceptions.RequestException:
+                key = "error"
+            with lock:
+                counts[key] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.monotonic() - started
+    return {"ok": counts["ok"], "errors": counts["error"], "images_per_sec": counts["ok"] / elapsed}
+
+
+def measure(workers: int, port: int, image: bytes, concurrency: int, duration: float) -> Dict:
+    base_url = f"http://127.0.0.1:{port}"
+    proc = subprocess.Popen(
+        [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port), "--log-level", "warning"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        wait_until_ready(base_url + "/health/ready", workers)
+        load = run_load(base_url + "/predict", image, concurrency, duration)
+
+        parent = read_memory_kb(proc.pid)
+        children = [read_memory_kb(pid) for pid in child_pids(proc.pid)]
+        total_pss = parent["pss_kb"] + sum(c["pss_kb"] for c in children)
+        return {
+            "workers": workers,
+            "parent_rss_mb": parent["rss_kb"] / 1024,
+            "worker_rss_mb": [c["rss_kb"] / 1024 for c in children],
+            "worker_pss_mb": [c["pss_kb"] / 1024 for c in children],
+            "total_pss_mb": total_pss / 1024,
+            **load,
+        }
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Đo RSS/PSS và thông lượng theo số worker")
+    parser.add_argument("--image", required=True, help="Ảnh dùng để gửi tới /predict")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--json-out", help="Ghi kết quả ra file JSON")
+    args = parser.parse_args(argv)
+
+    with open(args.image, "rb") as f:
+        image = f.read()
+
+    results = []
+    print(f"{'workers':>7} {'worker RSS (MB)':>16} {'worker PSS (MB)':>16} {'total PSS (MB)':>15} {'img/s':>8} {'errors':>7}")
+    for workers in args.workers:
+        r = measure(workers, args.port, image, args.concurrency, args.duration)
+        results.append(r)
+        avg_rss = sum(r["worker_rss_mb"]) / max(1, len(r["worker_rss_mb"]))
+        avg_pss = sum(r["worker_pss_mb"]) / max(1, len(r["worker_pss_mb"]))
+        print(f"{workers:>7} {avg_rss:>16.1f} {avg_pss:>16.1f} {r['total_pss_mb']:>15.1f} "
+              f"{r['images_per_sec']:>8.2f} {r['errors']:>7}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+"""Bộ đếm, gauge và histogram gọn nhẹ xuất theo định dạng văn bản của Prometheus.
+
+Mỗi lần ghi chỉ tốn một lần khóa và một phép tìm nhị phân trên danh sách
+bucket nên có thể để bật khi chạy thật. ``render()`` tạo nội dung cho
+endpoint ``/metrics``.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} cần các nhãn {self.labelnames}, nhận được {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """Giá trị chỉ tăng, ví dụ số lá đã phân loại"""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(v)}" for key, v in values.items()]
+
+
+class Gauge(Counter):
+    """Giá trị tăng giảm tùy ý, ví dụ số request đang xử lý"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Phân bố giá trị theo bucket cộng dồn, kèm tổng và số lần ghi"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Mỗi bộ nhãn: [số lần ghi của từng bucket (+Inf ở cuối), tổng]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.header())
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Các số đo của dịch vụ suy luận
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "leaf_stage_seconds", "Thời gian từng bước xử lý (một lần gọi, có thể cho cả batch)", ["stage"]
+))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    "leaf_request_seconds", "Thời gian xử lý một request", ["endpoint"]
+))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    "leaf_scheduler_batch_size", "Số ảnh trong mỗi batch của scheduler", buckets=(1, 2, 4, 8, 16, 32)
+))
+LEAVES_PER_IMAGE = REGISTRY.register(Histogram(
+    "leaf_leaves_per_image", "Số lá phát hiện được trên mỗi ảnh", buckets=(0, 1, 2, 4, 8, 16, 32, 64)
+))
+LEAVES_CLASSIFIED = REGISTRY.register(Counter(
+    "leaf_classified_total", "Số lá đã phân loại theo lớp dự đoán", ["class_name"]
+))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "leaf_scheduler_queue_depth", "Số ảnh đang chờ trong hàng đợi suy luận"
+))
+IN_FLIGHT = REGISTRY.register(Gauge(
+    "leaf_requests_in_flight", "Số request đang được xử lý", ["endpoint"]
+))
+ERRORS = REGISTRY.register(Counter(
+    "leaf_errors_total", "Số lỗi theo endpoint và loại lỗi", ["endpoint", "type"]
+))
+MODEL_LOAD_SECONDS = REGISTRY.register(Gauge(
+    "leaf_model_load_seconds", "Thời gian nạp mô hình và khởi động", ["model"]
+))
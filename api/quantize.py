@@ -0,0 +1,196 @@
+"""Tạo và đánh giá ResNet INT8 cho CPU.
+
+Hai chế độ:
+
+* ``dynamic``: chỉ lượng tử hóa động các lớp Linear của đầu MLP ``fc``,
+  backbone giữ FP32, không cần dữ liệu hiệu chỉnh.
+* ``static``: lượng tử hóa tĩnh (post-training) backbone conv với tập ảnh
+  hiệu chỉnh, cộng thêm lượng tử hóa động cho đầu ``fc``.
+
+Script chia ngẫu nhiên (cố định seed) các crop thành tập hiệu chỉnh và tập
+đánh giá không trùng nhau, hiệu chỉnh trên tập đầu rồi đo tốc độ và tỉ lệ
+trùng top-1 với FP32 trên tập sau. Mô hình chỉ được ghi ra (``pbl5_ver4.int8.torchscript.pt`` kèm báo cáo
+``pbl5_ver4.int8.json``) khi tỉ lệ trùng không thấp hơn ``--min-agreement``.
+Sau đó bật bằng ``CLASSIFIER_BACKEND=int8``.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python quantize.py --images ../leaf_crops --mode static --min-agreement 0.97
+    python quantize.py --images ../photos --detect --mode static
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.ao import quantization as tq
+from torchvision.models import quantization as quantizable_models
+
+from engines import exported_path, load_detector, load_resnet_model, report_path
+from handler import MODEL_RESNET_PATH, MODEL_YOLO_PATH, RESNET_INPUT_SIZE, YOLO_INPUT_SIZE, num_classes
+from image_processing import preprocess_leaves
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+def select_quantized_engine() -> str:
+    """Chọn engine lượng tử hóa tốt nhất có sẵn trên CPU hiện tại"""
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in torch.backends.quantized.supported_engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("PyTorch không hỗ trợ lượng tử hóa trên máy này")
+
+
+def quantize_head(head: nn.Module) -> nn.Module:
+    """Lượng tử hóa động các lớp Linear của đầu MLP"""
+    return tq.quantize_dynamic(head, {nn.Linear}, dtype=torch.qint8)
+
+
+def build_int8_model(fp32_model: nn.Module, mode: str, calibration_batches: List[torch.Tensor]) -> nn.Module:
+    head = quantize_head(fp32_model.fc)
+
+    if mode == "dynamic":
+        backbone = fp32_model
+        backbone.fc = nn.Identity()
+        return nn.Sequential(backbone, head).eval()
+
+    # Backbone dạng quantizable có cùng khóa state_dict với ResNet18 gốc
+    backbone = quantizable_models.resnet18(weights=None, quantize=False)
+    backbone.fc = nn.Identity()
+    state = {k: v for k, v in fp32_model.state_dict().items() if not k.startswith("fc.")}
+    backbone.load_state_dict(state)
+    backbone.eval()
+    backbone.fuse_model()
+    backbone.qconfig = tq.get_default_qconfig(torch.backends.quantized.engine)
+    tq.prepare(backbone, inplace=True)
+    with torch.no_grad():
+        for batch in calibration_batches:
+            backbone(batch)
+    tq.convert(backbone, inplace=True)
+    return nn.Sequential(backbone, head).eval()
+
+
+def load_crops(folder: str, detect: bool) -> List[np.ndarray]:
+    """Đọc ảnh trong thư mục; với ``detect`` thì cắt lá bằng YOLO"""
+    paths = sorted(
+        os.path.join(folder, name) for name in os.listdir(folder)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    images = []
+    for path in paths:
+        img = cv2.imread(path)
+        if img is not None:
+            images.append(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if not detect:
+        return images
+
+    detector = load_detector(MODEL_YOLO_PATH, "eager")
+    crops = []
+    for img in images:
+        boxes = detector.predict(source=img, imgsz=YOLO_INPUT_SIZE, conf=0.5, verbose=False)[0].boxes.xyxy.cpu().numpy()
+        h, w = img.shape[:2]
+        for x1, y1, x2, y2 in boxes.astype(int):
+            x1, y1, x2, y2 = max(0, x1), max(0, y1), min(w, x2), min(h, y2)
+            if x2 > x1 and y2 > y1:
+                crops.append(img[y1:y2, x1:x2])
+    return crops
+
+
+def to_batches(crops: List[np.ndarray], batch_size: int) -> List[torch.Tensor]:
+    return [
+        preprocess_leaves(crops[i:i + batch_size], RESNET_INPUT_SIZE).clone()
+        for i in range(0, len(crops), batch_size)
+    ]
+
+
+def predict_all(model: nn.Module, batches: List[torch.Tensor]):
+    """Chạy mô hình trên mọi batch, trả về (lớp dự đoán, thời gian giây)"""
+    preds = []
+    started = time.perf_counter()
+    with torch.no_grad():
+        for batch in batches:
+            preds.append(torch.argmax(model(batch), dim=1))
+    return torch.cat(preds), time.perf_counter() - started
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Hiệu chỉnh và đánh giá ResNet INT8")
+    parser.add_argument("--images", required=True, help="Thư mục ảnh lá (hoặc ảnh cây nếu dùng --detect)")
+    parser.add_argument("--detect", action="store_true", help="Cắt lá bằng YOLO trước khi hiệu chỉnh")
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    parser.add_argument("--calibration-size", type=int, default=64,
+                        help="Số crop dùng để hiệu chỉnh (tối đa một nửa số crop, phần còn lại để đánh giá)")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--min-agreement", type=float, default=0.97,
+                        help="Tỉ lệ trùng top-1 tối thiểu với FP32 để chấp nhận mô hình INT8")
+    args = parser.parse_args(argv)
+
+    engine = select_quantized_engine()
+    crops = load_crops(args.images, args.detect)
+    if not crops:
+        print(f"Không tìm thấy ảnh/lá nào trong {args.images}")
+        return 1
+
+    # Crop hiệu chỉnh không được đánh giá lại, nếu không tỉ lệ trùng bị đo lạc quan
+    calibration_count = min(args.calibration_size, len(crops) // 2)
+    if calibration_count < 1:
+        print(f"Cần ít nhất 2 crop để tách tập hiệu chỉnh và tập đánh giá, chỉ có {len(crops)}")
+        return 1
+    if calibration_count < args.calibration_size:
+        print(f"Chỉ dùng {calibration_count} crop để hiệu chỉnh, còn lại {len(crops) - calibration_count} crop để đánh giá")
+    order = np.random.default_rng(0).permutation(len(crops))
+    calibration_crops = [crops[i] for i in order[:calibration_count]]
+    evaluation_crops = [crops[i] for i in order[calibration_count:]]
+    calibration = to_batches(calibration_crops, args.batch_size)
+    evaluation = to_batches(evaluation_crops, args.batch_size)
+
+    fp32_model = load_resnet_model(MODEL_RESNET_PATH, num_classes, torch.device("cpu"))
+    int8_model = build_int8_model(
+        load_resnet_model(MODEL_RESNET_PATH, num_classes, torch.device("cpu")), args.mode, calibration
+    )
+    # Mỗi mô hình chạy một lần như nhau để loại bỏ chi phí khởi tạo khỏi phép đo
+    predict_all(fp32_model, evaluation[:1])
+    predict_all(int8_model, evaluation[:1])
+    fp32_preds, fp32_time = predict_all(fp32_model, evaluation)
+    int8_preds, int8_time = predict_all(int8_model, evaluation)
+
+    agreement = float((fp32_preds == int8_preds).float().mean())
+    speedup = fp32_time / int8_time if int8_time > 0 else 0.0
+    report = {
+        "mode": args.mode,
+        "quantized_engine": engine,
+        "crops": len(crops),
+        "calibration_crops": len(calibration_crops),
+        "evaluation_crops": len(evaluation_crops),
+        "top1_agreement": agreement,
+        "min_agreement": args.min_agreement,
+        "fp32_ms_per_crop": fp32_time / len(evaluation_crops) * 1000.0,
+        "int8_ms_per_crop": int8_time / len(evaluation_crops) * 1000.0,
+        "speedup": speedup,
+    }
+    print(json.dumps(report, indent=2))
+
+    if agreement < args.min_agreement:
+        print(f"Tỉ lệ trùng {agreement:.4f} < {args.min_agreement}, không bật chế độ INT8")
+        return 1
+
+    model_path = exported_path(MODEL_RESNET_PATH, "int8")
+    example = evaluation[0][:1]
+    with torch.no_grad():
+        traced = torch.jit.trace(int8_model, example)
+    torch.jit.save(traced, model_path)
+    with open(report_path(MODEL_RESNET_PATH), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Đã lưu mô hình INT8 -> {model_path}, bật bằng CLASSIFIER_BACKEND=int8")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
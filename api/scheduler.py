@@ -0,0 +1,175 @@
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from metrics import BATCH_SIZE, STAGE_SECONDS
+
+
+class QueueFullError(Exception):
+    """Hàng đợi suy luận đã đầy, request cần được từ chối ngay"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("Hàng đợi suy luận đã đầy")
+        self.retry_after = retry_after
+
+
+class InferenceScheduler:
+    """Gom các request đến gần nhau thành batch để chạy mô hình một lần.
+
+    Mỗi luồng worker lấy request đầu tiên trong hàng đợi, chờ thêm tối đa
+    ``max_wait_ms`` hoặc đến khi đủ ``max_batch_size`` request, rồi gọi
+    ``process_batch`` một lần cho cả batch và trả kết quả về từng Future.
+    Hàng đợi có giới hạn ``max_queue_size``; khi đầy, ``submit`` ném
+    ``QueueFullError`` thay vì để request chờ đến timeout.
+    """
+
+    def __init__(self, process_batch: Callable[[List[Any]], List[Any]],
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0,
+                 num_workers: int = 1, max_queue_size: int = 64):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.num_workers = max(1, num_workers)
+        self.max_queue_size = max(1, max_queue_size)
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(self.max_queue_size)
+        self._threads: List[threading.Thread] = []
+
+        # Thống kê để định cỡ dịch vụ
+        self._stats_lock = threading.Lock()
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._busy_workers = 0
+        self._wait_times = deque(maxlen=1000)
+        self._batch_sizes = deque(maxlen=1000)
+        self._batch_time_ema: Optional[float] = None
+
+    def start(self):
+        self._threads = [t for t in self._threads if t.is_alive()]
+        while len(self._threads) < self.num_workers:
+            thread = threading.Thread(target=self._run, name=f"inference-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, item: Any) -> Future:
+        """Đưa một mục vào hàng đợi, trả về Future chứa kết quả của mục đó"""
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((item, future, time.monotonic()))
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise QueueFullError(self.retry_after())
+        with self._stats_lock:
+            self._submitted += 1
+        return future
+
+    def retry_after(self) -> int:
+        """Ước lượng số giây đến khi hàng đợi có chỗ trống"""
+        batch_time = self._batch_time_ema or 1.0
+        batches_ahead = self._queue.qsize() / (self.max_batch_size * self.num_workers)
+        return max(1, math.ceil(batches_ahead * batch_time))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            waits = sorted(self._wait_times)
+            batch_sizes = list(self._batch_sizes)
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue_size": self.max_queue_size,
+                "workers": self.num_workers,
+                "busy_workers": self._busy_workers,
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "avg_wait_ms": sum(waits) / len(waits) * 1000.0 if waits else 0.0,
+                # Nearest-rank: giá trị nhỏ nhất mà ít nhất 95% mẫu không vượt quá
+                "p95_wait_ms": waits[math.ceil(0.95 * len(waits)) - 1] * 1000.0 if waits else 0.0,
+                "max_wait_ms_observed": waits[-1] * 1000.0 if waits else 0.0,
+                "avg_batch_size": sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+                "avg_batch_ms": (self._batch_time_ema or 0.0) * 1000.0,
+            }
+
+    def _collect_batch(self, first: tuple) -> List[tuple]:
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                # Trả lại tín hiệu dừng để vòng lặp chính xử lý sau batch này
+                self._queue.put(None)
+                break
+            batch.append(entry)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._process(self._collect_batch(first))
+
+    def _process(self, batch: List[tuple]):
+        # Bỏ qua các request đã bị hủy (client ngắt kết nối)
+        batch = [entry for entry in batch if entry[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        started = time.monotonic()
+        with self._stats_lock:
+            self._busy_workers += 1
+            self._wait_times.extend(started - enqueued for _, _, enqueued in batch)
+            self._batch_sizes.append(len(batch))
+        for _, _, enqueued in batch:
+            STAGE_SECONDS.observe(started - enqueued, stage="queue_wait")
+        BATCH_SIZE.observe(len(batch))
+
+        failed = 0
+        try:
+            results = self.process_batch([item for item, _, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+                failed = 1
+            else:
+                # Chạy lại từng mục để một ảnh lỗi không làm hỏng cả batch
+                for item, future, _ in batch:
+                    try:
+                        future.set_result(self.process_batch([item])[0])
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+                        failed += 1
+        else:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+        elapsed = time.monotonic() - started
+        with self._stats_lock:
+            self._busy_workers -= 1
+            self._completed += len(batch) - failed
+            self._failed += failed
+            if self._batch_time_ema is None:
+                self._batch_time_ema = elapsed
+            else:
+                self._batch_time_ema = 0.9 * self._batch_time_ema + 0.1 * elapsed
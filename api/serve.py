@@ -0,0 +1,123 @@
+"""Chạy API với nhiều worker uvicorn dùng chung một bản trọng số mô hình.
+
+Tiến trình cha import ``main`` và gọi ``handler.load_models()`` để nạp YOLO
+và ResNet một lần, dựng sẵn predictor của YOLO (gộp Conv+BN, xem
+``handler.setup_detector_predictor``), mở socket lắng nghe rồi ``fork`` ra các
+worker. Checkpoint ResNet (memory-map) và YOLO đã gộp nằm trong các trang bộ
+nhớ được chia sẻ copy-on-write giữa các worker vì không worker nào ghi vào
+chúng; ``gc.freeze()`` giữ cho bộ gom rác không chạm vào các object đã nạp sẵn
+và làm bẩn trang nhớ. Với ``DETECTOR_BACKEND=onnx`` mỗi worker tự mở phiên
+onnxruntime nên YOLO không được chia sẻ.
+
+Các luồng suy luận (scheduler) và bước warmup chỉ chạy bên trong từng worker
+sau khi fork, nên không được chạy suy luận ở tiến trình cha.
+
+Mỗi worker đặt số luồng torch và ghim CPU theo ``cpu_tuning`` (profile
+``cpu_profile.json`` hoặc biến môi trường). Với ``CPU_AUTOTUNE=1`` và chưa có
+profile, tiến trình cha chạy dò cấu hình trên ảnh lá trong ``--autotune-images``
+(hoặc ``CPU_AUTOTUNE_IMAGES``) trước khi fork.
+
+Cách dùng (chạy trong thư mục ``api``)::
+
+    python serve.py --workers 4 --port 8000
+    CPU_AUTOTUNE=1 python serve.py --workers 4 --autotune-images ../samples
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+from typing import List, Optional
+
+import uvicorn
+
+
+def create_socket(host: str, port: int, backlog: int = 2048) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, log_level: str):
+    config = uvicorn.Config(app, log_level=log_level, lifespan="on")
+    server = uvicorn.Server(config)
+    server.run(sockets=[sock])
+
+
+def serve(host: str, port: int, workers: int, log_level: str = "info", autotune_images: Optional[str] = None):
+    # Nạp mô hình một lần ở tiến trình cha trước khi fork
+    import cpu_tuning
+    import handler
+    from main import app
+    handler.load_models()
+    # Gộp Conv+BN của YOLO ngay ở đây để mọi worker dùng chung bản đã gộp
+    handler.setup_detector_predictor()
+    if os.getenv("CPU_AUTOTUNE", "0") == "1" and cpu_tuning.load_profile() is None:
+        try:
+            cpu_tuning.autotune(workers, autotune_images, duration=float(os.getenv("CPU_AUTOTUNE_SECONDS", "10")))
+        except RuntimeError as e:
+            # Không có profile thì worker dùng cấu hình mặc định
+            print(f"Bỏ qua dò cấu hình CPU: {e}")
+
+    sock = create_socket(host, port)
+    gc.collect()
+    gc.freeze()
+
+    children: List[int] = []
+    for worker_index in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            # Worker: để uvicorn tự xử lý tín hiệu dừng
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            # main.lifespan đọc hai biến này để chọn số luồng và nhóm lõi của worker
+            os.environ["API_WORKER_INDEX"] = str(worker_index)
+            os.environ["API_WORKERS"] = str(workers)
+            try:
+                run_worker(app, sock, log_level)
+            finally:
+                os._exit(0)
+        children.append(pid)
+
+    print(f"Đang phục vụ tại http://{host}:{port} với {workers} worker (pid cha {os.getpid()})")
+
+    def stop_children(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGINT, stop_children)
+    signal.signal(signal.SIGTERM, stop_children)
+
+    for pid in children:
+        while True:
+            try:
+                os.waitpid(pid, 0)
+                break
+            except InterruptedError:
+                continue
+            except ChildProcessError:
+                break
+    sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chạy API với nhiều worker dùng chung trọng số mô hình")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("API_WORKERS", "2")))
+    parser.add_argument("--log-level", default="info")
+    parser.add_argument("--autotune-images", default=os.getenv("CPU_AUTOTUNE_IMAGES"),
+                        help="Thư mục ảnh lá mẫu cho CPU_AUTOTUNE=1")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, max(1, args.workers), args.log_level, args.autotune_images)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
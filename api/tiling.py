@@ -0,0 +1,59 @@
+from typing import List, Tuple
+
+import numpy as np
+import torch
+from torchvision.ops import box_iou
+
+
+def make_tiles(height: int, width: int, tile_size: int, overlap: int) -> List[Tuple[int, int, int, int]]:
+    """Chia khung hình thành các ô (x1, y1, x2, y2) chồng lấn ``overlap`` pixel, phủ kín cả mép ảnh"""
+    stride = max(1, tile_size - overlap)
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size + 1, stride))
+        if positions[-1] + tile_size < length:
+            positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+
+def merge_tile_boxes(boxes: np.ndarray, scores: np.ndarray,
+                     iou_threshold: float = 0.5, containment_threshold: float = 0.8) -> np.ndarray:
+    """NMS giữa các ô, trả về chỉ số các box được giữ lại (theo điểm giảm dần).
+
+    Ngoài IoU, hai box còn bị coi là trùng nếu phần lớn diện tích của box nhỏ
+    hơn nằm trong box kia (lá bị mép ô cắt mất một phần); khi đó giữ box lớn hơn.
+    """
+    if len(boxes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    scores_t = torch.as_tensor(scores, dtype=torch.float32)
+    order = torch.argsort(scores_t, descending=True)
+    boxes_t = torch.as_tensor(boxes, dtype=torch.float32)[order]
+
+    areas = (boxes_t[:, 2] - boxes_t[:, 0]).clamp(min=0) * (boxes_t[:, 3] - boxes_t[:, 1]).clamp(min=0)
+    iou = box_iou(boxes_t, boxes_t)
+    # Giao = IoU * (A + B) / (1 + IoU)
+    inter = iou * (areas[:, None] + areas[None, :]) / (1 + iou)
+    containment = inter / torch.minimum(areas[:, None], areas[None, :]).clamp(min=1e-6)
+    duplicate = (iou >= iou_threshold) | (containment >= containment_threshold)
+
+    # NMS tham lam theo điểm giảm dần
+    selected: List[int] = []
+    for i in range(len(boxes_t)):
+        overlapping = [k for k, j in enumerate(selected) if duplicate[i, j]]
+        if not overlapping:
+            selected.append(i)
+        elif len(overlapping) == 1:
+            j = selected[overlapping[0]]
+            # Box đã giữ là mảnh bị cắt nằm trong box hiện tại: thay bằng box đầy đủ
+            if containment[i, j] >= containment_threshold and areas[i] > areas[j]:
+                selected[overlapping[0]] = i
+    return order[sorted(selected)].numpy()
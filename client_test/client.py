@@ -1,6 +1,7 @@
 
 import requests
 import os
+import json
 
 def send_image_to_server(image_path: str, server_url: str = "http://127.0.0.1:8000/predict"):
     """
@@ -40,6 +41,44 @@ def send_image_to_server(image_path: str, server_url: str = "http://127.0.0.1:80
     except requests.exceptions.RequestException as e:
         print(f"Error: Không thể kết nối đến server - {str(e)}")
 
+def send_images_batch(image_paths, server_url: str = "http://127.0.0.1:8000/predict/batch"):
+    """
+    Gửi nhiều ảnh (hoặc file zip/tar) trong một request và in kết quả NDJSON
+    ngay khi từng ảnh được xử lý xong.
+    
+    Args:
+        image_paths (list): Danh sách đường dẫn ảnh hoặc file nén
+        server_url (str): URL của endpoint predict/batch
+    """
+    files = []
+    try:
+        for path in image_paths:
+            content_type = "application/zip" if path.lower().endswith(".zip") else "image/jpeg"
+            if path.lower().endswith((".tar", ".tar.gz", ".tgz")):
+                content_type = "application/x-tar"
+            files.append(("files", (os.path.basename(path), open(path, "rb"), content_type)))
+        
+        with requests.post(server_url, files=files, stream=True) as response:
+            if response.status_code != 200:
+                print(f"Error: Server trả về mã lỗi {response.status_code}")
+                return
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                item = json.loads(line)
+                if item.get("status") != "ok":
+                    print(f"{item.get('filename')}: lỗi - {item.get('error')}")
+                    continue
+                for result in item["results"]:
+                    print(f"{item['filename']}: {result['predicted_class']} "
+                          f"(Độ tin cậy: {result['confidence']:.2f})")
+    
+    except requests.exceptions.RequestException as e:
+        print(f"Error: Không thể kết nối đến server - {str(e)}")
+    finally:
+        for _, (_, f, _) in files:
+            f.close()
+
 if __name__ == "__main__":
     # Ví dụ sử dụng
     image_path = input("Nhập đường dẫn file ảnh (jpg, jpeg, png): ")
@@ -0,0 +1,309 @@
+"""Tạo tải đồng thời cho API dự đoán bệnh lá.
+
+Gửi lần lượt các ảnh trong một thư mục tới ``/predict`` theo một trong hai
+chế độ:
+
+* ``--concurrency N``: N luồng, mỗi luồng gửi request mới ngay khi nhận
+  được phản hồi (vòng kín);
+* ``--rate R``: R request/giây theo lịch cố định bất kể server nhanh hay
+  chậm (vòng hở). Độ trễ tính từ thời điểm lẽ ra phải gửi, nên thời gian
+  chờ khi client bị dồn việc cũng được tính vào.
+
+Mỗi luồng giữ một ``requests.Session`` riêng để dùng lại kết nối keep-alive.
+Kết quả gồm histogram độ trễ, p50/p90/p99, thông lượng và số lỗi theo loại,
+có thể ghi ra JSON. ``--stub`` chạy một server giả trong cùng tiến trình
+(không cần mô hình) để tự kiểm tra công cụ.
+
+Cách dùng::
+
+    python load_test.py --images ../samples --concurrency 8 --duration 30 --json-out load.json
+    python load_test.py --images ../samples --rate 5 --duration 60 --header "X-Cache-Bypass: 1"
+    python load_test.py --stub --stub-delay-ms 50 --stub-error-rate 0.05 --concurrency 4
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+import requests
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+# Biên trên của các bucket histogram (ms), tăng theo cấp số nhân
+HISTOGRAM_BOUNDS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+
+
+def load_images(folder: Optional[str]) -> List[Tuple[str, bytes]]:
+    """Đọc toàn bộ ảnh vào bộ nhớ trước để không đo cả thời gian đọc đĩa"""
+    if folder is None:
+        # Dữ liệu giả cho chế độ --stub
+        return [("stub.jpg", b"\xff\xd8" + os.urandom(2048) + b"\xff\xd9")]
+    images = []
+    for name in sorted(os.listdir(folder)):
+        if name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(folder, name), "rb") as f:
+                images.append((name, f.read()))
+    return images
+
+
+class LoadStats:
+    """Gom độ trễ và lỗi từ nhiều luồng"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies_ms: List[float] = []
+        self.errors: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.cache: Counter = Counter()
+
+    def record(self, latency_ms: float, status: Optional[int], error: Optional[str], cache: Optional[str]):
+        with self._lock:
+            if status is not None:
+                self.statuses[str(status)] += 1
+            if error is None:
+                self.latencies_ms.append(latency_ms)
+            else:
+                self.errors[error] += 1
+            if cache:
+                self.cache[cache] += 1
+
+    def summary(self, elapsed: float) -> Dict:
+        with self._lock:
+            latencies = sorted(self.latencies_ms)
+            errors = dict(self.errors)
+            statuses = dict(self.statuses)
+            cache = dict(self.cache)
+
+        def percentile(p: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(round(p / 100.0 * (len(latencies) - 1))))]
+
+        counts = [0] * (len(HISTOGRAM_BOUNDS_MS) + 1)
+        for latency in latencies:
+            counts[bisect.bisect_left(HISTOGRAM_BOUNDS_MS, latency)] += 1
+        histogram = [
+            {"le_ms": bound, "count": count}
+            for bound, count in zip(HISTOGRAM_BOUNDS_MS + ["+Inf"], counts)
+        ]
+        total = len(latencies) + sum(errors.values())
+        return {
+            "requests": total,
+            "succeeded": len(latencies),
+            "failed": sum(errors.values()),
+            "duration_s": elapsed,
+            "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+            "latency_ms": {
+                "min": latencies[0] if latencies else None,
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": percentile(50),
+                "p90": percentile(90),
+                "p99": percentile(99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "histogram": histogram,
+            "status_codes": statuses,
+            "errors": errors,
+            "cache": cache,
+        }
+
+
+class LoadGenerator:
+    def __init__(self, url: str, images: List[Tuple[str, bytes]], headers: Dict[str, str], timeout: float):
+        self.url = url
+        self.images = itertools.cycle(images)
+        self._images_lock = threading.Lock()
+        self.headers = headers
+        self.timeout = timeout
+        self.stats = LoadStats()
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next_image(self) -> Tuple[str, bytes]:
+        with self._images_lock:
+            return next(self.images)
+
+    def send_one(self, scheduled: Optional[float] = None):
+        """Gửi một ảnh; độ trễ tính từ ``scheduled`` nếu có (chế độ --rate)"""
+        name, data = self._next_image()
+        started = scheduled if scheduled is not None else time.perf_counter()
+        status, error, cache = None, None, None
+        try:
+            response = self._session().post(
+                self.url, files={"file": (name, data, "image/jpeg")}, headers=self.headers, timeout=self.timeout
+            )
+            status = response.status_code
+            cache = response.headers.get("X-Cache")
+            if status != 200:
+                error = f"http_{status}"
+        except requests.exceptions.RequestException as e:
+            error = type(e).__name__
+        self.stats.record((time.perf_counter() - started) * 1000.0, status, error, cache)
+
+    def run_closed_loop(self, concurrency: int, duration: float, max_requests: Optional[int]) -> float:
+        deadline = time.perf_counter() + duration
+        remaining = itertools.count() if max_requests is None else iter(range(max_requests))
+        remaining_lock = threading.Lock()
+
+        def worker():
+            while time.perf_counter() < deadline:
+                with remaining_lock:
+                    if next(remaining, None) is None:
+                        return
+                self.send_one()
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    def run_open_loop(self, rate: float, duration: float, max_requests: Optional[int], max_workers: int) -> float:
+        interval = 1.0 / rate
+        total = int(duration * rate) if max_requests is None else min(max_requests, int(duration * rate))
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for i in range(total):
+                scheduled = started + i * interval
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send_one, scheduled)
+        return time.perf_counter() - started
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Server giả trả kết quả cố định sau ``delay_ms``, lỗi 503 với xác suất ``error_rate``"""
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    delay_ms = 20.0
+    error_rate = 0.0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay_ms / 1000.0)
+        if random.random() < self.error_rate:
+            status, body = 503, {"detail": "Máy chủ đang quá tải, vui lòng thử lại sau"}
+        else:
+            status, body = 200, [{"leaf_index": 1, "predicted_class": "Tình trạng cây: Healthy-Leaf", "confidence": 0.99}]
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Cache", "MISS")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(delay_ms: float, error_rate: float) -> Tuple[ThreadingHTTPServer, str]:
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"delay_ms": delay_ms, "error_rate": error_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/predict"
+
+
+def parse_headers(values: List[str]) -> Dict[str, str]:
+    headers = {}
+    for value in values:
+        key, _, content = value.partition(":")
+        headers[key.strip()] = content.strip()
+    return headers
+
+
+def print_summary(summary: Dict):
+    latency = summary["latency_ms"]
+    print(f"\nRequest: {summary['requests']} (thành công {summary['succeeded']}, lỗi {summary['failed']}) "
+          f"trong {summary['duration_s']:.1f}s, {summary['throughput_rps']:.2f} request/s")
+    if latency["p50"] is not None:
+        print(f"Độ trễ (ms): min {latency['min']:.1f}  p50 {latency['p50']:.1f}  p90 {latency['p90']:.1f}  "
+              f"p99 {latency['p99']:.1f}  max {latency['max']:.1f}")
+        peak = max(bucket["count"] for bucket in summary["histogram"]) or 1
+        for bucket in summary["histogram"]:
+            if bucket["count"]:
+                bar = "#" * max(1, round(40 * bucket["count"] / peak))
+                print(f"  <= {str(bucket['le_ms']):>6} ms {bucket['count']:>7}  {bar}")
+    if summary["errors"]:
+        print("Lỗi: " + ", ".join(f"{kind}={count}" for kind, count in sorted(summary["errors"].items())))
+    if summary["cache"]:
+        print("X-Cache: " + ", ".join(f"{kind}={count}" for kind, count in sorted(summary["cache"].items())))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Tạo tải đồng thời cho /predict")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/predict")
+    parser.add_argument("--images", help="Thư mục ảnh gửi lần lượt (vòng lại khi hết)")
+    parser.add_argument("--concurrency", type=int, default=4, help="Số luồng gửi song song (vòng kín)")
+    parser.add_argument("--rate", type=float, help="Số request/giây cố định (vòng hở), thay cho --concurrency")
+    parser.add_argument("--max-workers", type=int, default=64, help="Số luồng tối đa ở chế độ --rate")
+    parser.add_argument("--duration", type=float, default=30.0, help="Số giây chạy")
+    parser.add_argument("--requests", type=int, help="Dừng sau số request này")
+    parser.add_argument("--header", action="append", default=[], help='Header thêm, ví dụ "X-Cache-Bypass: 1"')
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--json-out", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--stub", action="store_true", help="Chạy server giả trong tiến trình, không cần mô hình")
+    parser.add_argument("--stub-delay-ms", type=float, default=20.0)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    args = parser.parse_args(argv)
+
+    if args.images is None and not args.stub:
+        parser.error("cần --images hoặc --stub")
+    images = load_images(args.images)
+    if not images:
+        print(f"Error: Không tìm thấy ảnh nào trong {args.images}")
+        return 1
+
+    server, url = None, args.url
+    if args.stub:
+        server, url = start_stub_server(args.stub_delay_ms, args.stub_error_rate)
+    mode = f"{args.rate} request/s" if args.rate else f"{args.concurrency} luồng"
+    print(f"Gửi {len(images)} ảnh tới {url} với {mode} trong {args.duration}s")
+
+    generator = LoadGenerator(url, images, parse_headers(args.header), args.timeout)
+    try:
+        if args.rate:
+            elapsed = generator.run_open_loop(args.rate, args.duration, args.requests, args.max_workers)
+        else:
+            elapsed = generator.run_closed_loop(args.concurrency, args.duration, args.requests)
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    summary = generator.stats.summary(elapsed)
+    print_summary(summary)
+    if args.json_out:
+        report = {
+            "url": url,
+            "mode": "open_loop" if args.rate else "closed_loop",
+            "concurrency": None if args.rate else args.concurrency,
+            "rate": args.rate,
+            "images": len(images),
+            "stub": args.stub,
+            **summary,
+        }
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Đã ghi kết quả -> {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
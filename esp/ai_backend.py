@@ -0,0 +1,153 @@
+import abc
+import os
+import sys
+import threading
+import time
+
+import cv2
+import requests
+import requests.exceptions
+
+from logger_config import smart_garden_logger
+
+# Thư mục api chứa handler.py và các file trọng số mô hình
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "api")
+
+
+class AIBackend(abc.ABC):
+    """Giao diện chung để gửi ảnh lá đi phân tích
+
+    ``predict`` nhận ảnh BGR đã giải mã (như cv2.imread), ``predict_file``
+    nhận đường dẫn ảnh. Cả hai trả về danh sách kết quả như API ``/predict``
+    hoặc None nếu lỗi, và ghi log thời gian từng lần gọi.
+    """
+    name = "base"
+
+    @abc.abstractmethod
+    def predict(self, image, label="array"):
+        ...
+
+    @abc.abstractmethod
+    def predict_file(self, image_path):
+        ...
+
+    def _log_timing(self, label, started, **stages):
+        total_ms = (time.perf_counter() - started) * 1000.0
+        details = ", ".join(f"{stage}: {ms:.1f}ms" for stage, ms in stages.items())
+        smart_garden_logger.info(
+            f"AI backend: {self.name}, Image: {label}, Total: {total_ms:.1f}ms"
+            + (f", {details}" if details else "")
+        )
+
+
+class InProcessBackend(AIBackend):
+    """Gọi thẳng pipeline trong api/handler.py trên ảnh đã giải mã, không qua HTTP"""
+    name = "inprocess"
+
+    def __init__(self, api_dir=API_DIR):
+        self.api_dir = os.path.abspath(api_dir)
+        self._handler = None
+        self._lock = threading.Lock()
+
+    def _get_handler(self):
+        if self._handler is None:
+            with self._lock:
+                if self._handler is None:
+                    if self.api_dir not in sys.path:
+                        sys.path.insert(0, self.api_dir)
+                    import handler
+                    # Đường dẫn trọng số trong handler là tương đối so với thư mục api
+                    handler.MODEL_YOLO_PATH = os.path.join(self.api_dir, handler.MODEL_YOLO_PATH)
+                    handler.MODEL_RESNET_PATH = os.path.join(self.api_dir, handler.MODEL_RESNET_PATH)
+                    handler.load_models()
+                    self._handler = handler
+        return self._handler
+
+    def predict(self, image, label="array"):
+        started = time.perf_counter()
+        try:
+            handler = self._get_handler()
+            loaded = time.perf_counter()
+            rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            inference_started = time.perf_counter()
+            results = handler.process_leaf_array(rgb)
+            finished = time.perf_counter()
+            # Cùng dạng với phản hồi của /predict
+            results = [{"leaf_index": i + 1, **result} for i, result in enumerate(results)]
+        except Exception as e:
+            smart_garden_logger.error(f"Error processing image with AI (in-process): {str(e)}")
+            return None
+        self._log_timing(
+            label, started,
+            load=(loaded - started) * 1000.0,
+            convert=(inference_started - loaded) * 1000.0,
+            inference=(finished - inference_started) * 1000.0,
+        )
+        return results
+
+    def predict_file(self, image_path):
+        image = cv2.imread(image_path)
+        if image is None:
+            smart_garden_logger.error(f"Không thể đọc ảnh {image_path}")
+            return None
+        return self.predict(image, os.path.basename(image_path))
+
+
+class HttpBackend(AIBackend):
+    """Gửi ảnh tới API FastAPI qua một session keep-alive dùng chung cho mọi lần gọi"""
+    name = "http"
+
+    def __init__(self, api_url, session, timeout=30, jpeg_quality=95):
+        self.api_url = api_url
+        self.session = session
+        self.timeout = timeout
+        self.jpeg_quality = jpeg_quality
+
+    def predict(self, image, label="array"):
+        started = time.perf_counter()
+        ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            smart_garden_logger.error("Không thể mã hóa ảnh để gửi tới AI API")
+            return None
+        return self._post(encoded.tobytes(), label, started, encode=(time.perf_counter() - started) * 1000.0)
+
+    def predict_file(self, image_path):
+        started = time.perf_counter()
+        with open(image_path, "rb") as f:
+            data = f.read()
+        return self._post(data, os.path.basename(image_path), started, read=(time.perf_counter() - started) * 1000.0)
+
+    def _post(self, data, label, started, **stages):
+        request_started = time.perf_counter()
+        try:
+            files = {"file": (label if label.lower().endswith((".jpg", ".jpeg", ".png")) else "image.jpg",
+                              data, "image/jpeg")}
+            response = self.session.post(self.api_url, files=files, timeout=self.timeout)
+        except requests.exceptions.Timeout:
+            smart_garden_logger.error(f"API xử lý ảnh timeout ({label})")
+            return None
+        except requests.exceptions.ConnectionError:
+            smart_garden_logger.error(f"Không thể kết nối đến API xử lý ảnh ({label})")
+            return None
+        stages["request"] = (time.perf_counter() - request_started) * 1000.0
+
+        if response.status_code != 200:
+            try:
+                error_detail = response.json().get("detail", "Không có chi tiết lỗi")
+            except ValueError:
+                error_detail = response.text
+            smart_garden_logger.error(
+                f"Error from AI API: Server trả về mã lỗi {response.status_code}, chi tiết: {error_detail}"
+            )
+            return None
+        self._log_timing(label, started, **stages)
+        return response.json()
+
+
+def create_ai_backend(mode, api_url, session_factory):
+    """Tạo backend theo ``mode``: "http" (mặc định) hoặc "inprocess" """
+    if mode == "inprocess":
+        return InProcessBackend()
+    if mode != "http":
+        raise ValueError(f"AI_BACKEND không hợp lệ: {mode} (chọn http hoặc inprocess)")
+    return HttpBackend(api_url, session_factory())
@@ -1,7 +1,6 @@
 from flask import Flask, render_template, jsonify, send_from_directory, request
 from flask_cors import CORS
 import paho.mqtt.client as mqtt
-import sqlite3
 import os
 import requests
 from datetime import datetime
@@ -10,11 +9,20 @@ from urllib3.util.retry import Retry
 from requests.adapters import HTTPAdapter
 import requests.exceptions
 import json
+import math
+from numbers import Real
 import cv2
 import numpy as np
 from smart_controller import SmartController
 from device_manager import DeviceStateManager
+from ai_backend import create_ai_backend
+from sensor_writer import SensorWriter
+from db import Database, DATABASE_PATH
+from logger_config import smart_garden_logger as logger
+from schema import init_schema, now_ms
+from rollup import RESOLUTIONS, SENSORS, choose_resolution, query_rollups
 import threading
+import atexit
 
 app = Flask(__name__)
 CORS(app)
@@ -30,40 +38,33 @@ ESP32_WEBCAM_URL = "http://192.168.141.171/capture?quality=10&resolution=UXGA"
 # UXGA = 1600x1200, chất lượng: giá trị thấp hơn = chất lượng cao hơn (10-63)
 
 # AI API URL
-AI_API_URL = "http://127.0.0.1:8000/predict"
-
-# Khởi tạo SQLite
+AI_API_URL = os.getenv("AI_API_URL", "http://127.0.0.1:8000/predict")
+# Cách gọi AI: "http" (gửi tới API qua một session keep-alive) hoặc
+# "inprocess" (chạy thẳng pipeline trong api/handler.py, không qua mạng)
+AI_BACKEND = os.getenv("AI_BACKEND", "http")
+
+# Ghi số liệu cảm biến theo lô: mỗi SENSOR_FLUSH_INTERVAL giây hoặc khi đủ
+# SENSOR_BATCH_SIZE bản ghi; bộ đệm tối đa SENSOR_BUFFER_SIZE bản ghi
+SENSOR_FLUSH_INTERVAL = float(os.getenv("SENSOR_FLUSH_INTERVAL", "2.0"))
+SENSOR_BATCH_SIZE = int(os.getenv("SENSOR_BATCH_SIZE", "50"))
+SENSOR_BUFFER_SIZE = int(os.getenv("SENSOR_BUFFER_SIZE", "1000"))
+# /api/data/history với resolution=auto: trả số liệu thô cho cửa sổ tới
+# HISTORY_RAW_MAX_HOURS giờ, dài hơn thì dùng bảng tổng hợp mịn nhất mà
+# không vượt HISTORY_MAX_POINTS điểm. Mọi độ phân giải tổng hợp trả tối đa
+# HISTORY_MAX_POINTS khoảng
+HISTORY_RAW_MAX_HOURS = float(os.getenv("HISTORY_RAW_MAX_HOURS", "1"))
+HISTORY_MAX_POINTS = int(os.getenv("HISTORY_MAX_POINTS", "1000"))
+
+# Khởi tạo SQLite: mọi truy vấn đi qua pool kết nối dùng chung (WAL, busy timeout, đo thời gian)
+db = Database(DATABASE_PATH)
 
 
 def init_db():
-    conn = sqlite3.connect("database.db")
-    c = conn.cursor()
-
-    # Create tables with proper schema
-    c.execute('''CREATE TABLE IF NOT EXISTS sensor_data (
-        timestamp TEXT,
-        temperature REAL,
-        humidity REAL,
-        light REAL,
-        moisture INTEGER
-    )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS leaf_images (
-        timestamp TEXT,
-        image TEXT,
-        analysis TEXT
-    )''')
-
-    # Create table for device status tracking
-    c.execute('''CREATE TABLE IF NOT EXISTS device_status (
-        timestamp TEXT,
-        device_type TEXT,
-        device_id TEXT,
-        status TEXT
-    )''')
-
-    conn.commit()
-    conn.close()
+    with db.connection() as conn:
+        # Tạo bảng/index và chuyển DB cũ (timestamp TEXT) sang epoch ms
+        migrated = init_schema(conn)
+    for table, counts in migrated.items():
+        print(f"Migrated {table}: {counts['migrated']}/{counts['rows']} rows")
 
 
 def rotate_image_180(image_path):
@@ -101,8 +102,18 @@ def rotate_image_180(image_path):
         return False
 
 
-def process_image_with_ai(image_path):
+def process_image_with_ai(image_path, image=None):
+    """
+    Phân tích ảnh lá bằng AI backend đã cấu hình
+
+    Args:
+        image_path (str): Đường dẫn ảnh
+        image (np.ndarray, optional): Ảnh BGR đã giải mã sẵn, tránh đọc lại từ đĩa
+    """
     try:
+        if image is not None:
+            return ai_backend.predict(image, os.path.basename(image_path))
+
         if not os.path.exists(image_path):
             print(f"Error: File {image_path} không tồn tại")
             return None
@@ -111,26 +122,8 @@ def process_image_with_ai(image_path):
             print("Error: File phải là ảnh (jpg, jpeg, hoặc png)")
             return None
 
-        session = create_session_with_retries()
-        with open(image_path, "rb") as f:
-            files = {"file": (os.path.basename(image_path), f, "image/jpeg")}
-            response = session.post(AI_API_URL, files=files, timeout=30)
-
-        if response.status_code == 200:
-            return response.json()
-        else:
-            error_detail = response.json().get("detail", "Không có chi tiết lỗi")
-            print(
-                f"Error from AI API: Server trả về mã lỗi {response.status_code}")
-            print(f"Chi tiết lỗi: {error_detail}")
-            return None
+        return ai_backend.predict_file(image_path)
 
-    except requests.exceptions.Timeout:
-        print("Error: API xử lý ảnh timeout")
-        return None
-    except requests.exceptions.ConnectionError:
-        print("Error: Không thể kết nối đến API xử lý ảnh")
-        return None
     except Exception as e:
         print(f"Error processing image with AI: {str(e)}")
         return None
@@ -150,6 +143,10 @@ def create_session_with_retries():
     return session
 
 
+# Backend AI dùng chung cho cả ứng dụng (session HTTP được giữ suốt vòng đời)
+ai_backend = create_ai_backend(AI_BACKEND, AI_API_URL, create_session_with_retries)
+
+
 def save_image_from_esp32():
     try:
         session = create_session_with_retries()
@@ -163,27 +160,25 @@ def save_image_from_esp32():
             image_path = os.path.join(
                 app.config['UPLOAD_FOLDER'], image_filename)
 
-            # Save the image
-            with open(image_path, 'wb') as f:
-                f.write(response.content)
-
-            # Rotate the image 180 degrees
-            rotate_success = rotate_image_180(image_path)
-            if not rotate_success:
-                print(f"Warning: Failed to rotate image {image_filename}")
+            # Giải mã một lần, xoay 180 độ trong bộ nhớ rồi lưu
+            image = cv2.imdecode(np.frombuffer(response.content, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is not None:
+                image = cv2.flip(image, -1)
+                cv2.imwrite(image_path, image)
+            else:
+                print(f"Warning: Failed to decode image {image_filename}")
+                with open(image_path, 'wb') as f:
+                    f.write(response.content)
 
-            # Process with AI
-            analysis_results = process_image_with_ai(image_path)
+            # Process with AI trên ảnh đã giải mã
+            analysis_results = process_image_with_ai(image_path, image)
 
             # Save to database
-            conn = sqlite3.connect("database.db")
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (datetime('now'), ?, ?)",
-                (image_filename, str(analysis_results))
+            db.execute(
+                "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (?, ?, ?)",
+                (now_ms(), image_filename, str(analysis_results)),
+                label="leaf_images_insert"
             )
-            conn.commit()
-            conn.close()
 
             return image_filename, analysis_results
         else:
@@ -244,41 +239,95 @@ def on_message(client, userdata, msg):
         # Handle sensor messages
         if topic.startswith("sensor/") and "type" in data and "device_id" in data and "value" in data and "time" in data:
             if data["type"] == "Temperature":
-                latest_data["temperature"] = data["value"]
+                sensor = "temperature"
             elif data["type"] == "Humidity":
-                latest_data["humidity"] = data["value"]
+                sensor = "humidity"
             elif data["type"] == "Light":
-                latest_data["light"] = data["value"]
+                sensor = "light"
             elif data["type"] == "Soil_Moisture":
-                latest_data["moisture"] = data["value"]
+                sensor = "moisture"
+            else:
+                return
+            # Chỉ nhận số JSON hữu hạn; bool là lớp con của int nên phải loại riêng
+            raw_value = data["value"]
+            try:
+                if isinstance(raw_value, bool) or not isinstance(raw_value, Real):
+                    raise TypeError
+                value = float(raw_value)
+                if not math.isfinite(value):
+                    raise ValueError
+            except (TypeError, ValueError, OverflowError):
+                logger.warning(f"Rejected {data['type']} reading from {data['device_id']}: {raw_value!r}")
+                return
+            latest_data[sensor] = value
+
+            # Mỗi tin nhắn là một dòng chỉ có cột của cảm biến vừa gửi, các cột khác để NULL
+            # (không lặp lại giá trị cũ); luồng nền ghi xuống sensor_data và bảng tổng hợp
+            readings = {name: None for name in SENSORS}
+            readings[sensor] = value
+            sensor_writer.add((
+                now_ms(),
+                readings["temperature"],
+                readings["humidity"],
+                readings["light"],
+                readings["moisture"],
+            ), sensor)
 
         # Handle device status messages
         elif topic.startswith("device/") and "type" in data and "device_id" in data and "status" in data and "time" in data:
             # Update device state
-            device_manager.set_device_state(data["device_id"], data["status"], "raspberry")
+            device_manager.set_device_state(data["device_id"], data["status"], "raspberry", data["type"])
 
     except Exception as e:
         print(f"Error processing MQTT message: {e}")
 
 
+# Trạng thái thiết bị dùng chung cho on_message và SmartController, khôi phục từ device_status
+device_manager = DeviceStateManager(db)
+
+sensor_writer = SensorWriter(
+    db,
+    batch_size=SENSOR_BATCH_SIZE,
+    flush_interval=SENSOR_FLUSH_INTERVAL,
+    max_buffer=SENSOR_BUFFER_SIZE,
+)
+
 client.on_connect = on_connect
 client.on_message = on_message
 
+# Thay đổi địa chỉ IP này thành IP mới của Raspberry Pi
+RASPBERRY_PI_IP = "192.168.141.250"  # Cập nhật IP này sau khi kiểm tra
 mqtt_enabled = False
-try:
-    # Thay đổi địa chỉ IP này thành IP mới của Raspberry Pi
-    RASPBERRY_PI_IP = "192.168.141.250"  # Cập nhật IP này sau khi kiểm tra
-    client.connect(RASPBERRY_PI_IP, 1883, 60)
-    client.loop_start()
-    mqtt_enabled = True
-    print(f"Connected to MQTT broker at {RASPBERRY_PI_IP}")
-except Exception as e:
-    print(f"Failed to connect to MQTT broker: {e}")
-    print("MQTT functionality is disabled")
-
-# Initialize device manager and smart controller
-device_manager = DeviceStateManager()
-smart_controller = SmartController(client)  # Initialize with MQTT client
+
+
+def start_services():
+    """Tạo/chuyển đổi DB, khôi phục trạng thái thiết bị, khởi động luồng ghi nền và MQTT.
+
+    Chỉ gọi trong tiến trình phục vụ request: với debug=True, reloader của
+    werkzeug nạp module này ở cả tiến trình cha lẫn tiến trình con, nếu khởi
+    động ở mức module thì mỗi số liệu MQTT và mỗi sự kiện thiết bị sẽ được
+    nhận và ghi hai lần.
+    """
+    global mqtt_enabled
+    init_db()
+    device_manager.recover()
+    device_manager.start()
+    atexit.register(device_manager.close)
+
+    sensor_writer.start()
+    atexit.register(sensor_writer.stop)
+
+    try:
+        client.connect(RASPBERRY_PI_IP, 1883, 60)
+        client.loop_start()
+        mqtt_enabled = True
+        print(f"Connected to MQTT broker at {RASPBERRY_PI_IP}")
+    except Exception as e:
+        print(f"Failed to connect to MQTT broker: {e}")
+        print("MQTT functionality is disabled")
+
+# Initialize smart controller with the shared device manager
+smart_controller = SmartController(client, device_manager)  # Initialize with MQTT client
 
 
 @app.route("/")
@@ -295,23 +344,44 @@ def get_data():
 def get_sensor_history():
     try:
         # Get query parameters for filtering
-        limit = request.args.get('limit', 100, type=int)
         hours = request.args.get('hours', 24, type=int)
 
-        conn = sqlite3.connect("database.db")
-        c = conn.cursor()
+        # Khoảng thời gian theo epoch ms: start/end nếu có, mặc định N giờ gần nhất
+        end = request.args.get('end', now_ms(), type=int)
+        start = request.args.get('start', end - hours * 3600 * 1000, type=int)
 
-        # Get sensor data from the last N hours
-        c.execute("""
-            SELECT timestamp, temperature, humidity, light, moisture 
-            FROM sensor_data 
-            WHERE datetime(timestamp) >= datetime('now', '-{} hours')
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        """.format(hours), (limit,))
+        # raw (mặc định, các dòng thô như trước), 1m, 1h, 1d hoặc auto (chọn theo độ dài cửa sổ)
+        resolution = request.args.get('resolution', 'raw')
+        if resolution == 'auto':
+            resolution = choose_resolution(end - start, HISTORY_MAX_POINTS, int(HISTORY_RAW_MAX_HOURS * 3600 * 1000))
+        if resolution != 'raw' and resolution not in RESOLUTIONS:
+            return jsonify({
+                'status': 'error',
+                'message': f'Invalid resolution: {resolution} (raw, {", ".join(RESOLUTIONS)} or auto)'
+            }), 400
+
+        if resolution != 'raw':
+            # Mỗi điểm là một khoảng với min/max/avg/count của từng cảm biến;
+            # tối đa ``limit`` khoảng mới nhất, không vượt HISTORY_MAX_POINTS
+            limit = min(request.args.get('limit', HISTORY_MAX_POINTS, type=int), HISTORY_MAX_POINTS)
+            history = query_rollups(db, resolution, start, end, limit)
+            return jsonify({
+                'status': 'success',
+                'resolution': resolution,
+                'data': history,
+                'count': len(history),
+                'latest': latest_data
+            })
 
-        rows = c.fetchall()
-        conn.close()
+        # Quét theo khoảng trên index (timestamp, ...), không tính lại từng dòng
+        limit = request.args.get('limit', 100, type=int)
+        rows = db.query("""
+            SELECT timestamp, temperature, humidity, light, moisture
+            FROM sensor_data
+            WHERE timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (start, end, limit), label="sensor_history")
 
         # Convert to list of dictionaries
         history = []
@@ -326,6 +396,7 @@ def get_sensor_history():
 
         return jsonify({
             'status': 'success',
+            'resolution': resolution,
             'data': history,
             'count': len(history),
             'latest': latest_data
@@ -347,11 +418,23 @@ def get_debug():
         "latest_data": latest_data,
         "upload_folder_exists": os.path.exists(UPLOAD_FOLDER),
         "image_count": len([f for f in os.listdir(UPLOAD_FOLDER) if f.endswith('.jpg')]) if os.path.exists(UPLOAD_FOLDER) else 0,
-        "ai_api_url": AI_API_URL
+        "ai_api_url": AI_API_URL,
+        "sensor_writer": sensor_writer.stats(),
+        "database": db.stats()
     }
     return jsonify(debug_info)
 
 
+@app.route("/api/db/stats")
+def get_db_stats():
+    return jsonify(db.stats())
+
+
+@app.route("/api/sensor-writer/stats")
+def get_sensor_writer_stats():
+    return jsonify(sensor_writer.stats())
+
+
 @app.route('/capture-image')
 def capture_image():
     try:
@@ -478,14 +561,11 @@ def capture_and_analyze():
             image_filename = os.path.basename(image_path)
 
             # Save to database
-            conn = sqlite3.connect("database.db")
-            c = conn.cursor()
-            c.execute(
-                "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (datetime('now'), ?, ?)",
-                (image_filename, str(analysis_results))
+            db.execute(
+                "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (?, ?, ?)",
+                (now_ms(), image_filename, str(analysis_results)),
+                label="leaf_images_insert"
             )
-            conn.commit()
-            conn.close()
 
             return jsonify({
                 'status': 'success',
@@ -568,14 +648,11 @@ def analyze_uploaded_image():
 
         if analysis_results:
             # Cập nhật kết quả phân tích vào database
-            conn = sqlite3.connect("database.db")
-            c = conn.cursor()
-            c.execute(
+            db.execute(
                 "UPDATE leaf_images SET analysis = ? WHERE image = ?",
-                (str(analysis_results), filename)
+                (str(analysis_results), filename),
+                label="leaf_images_update"
             )
-            conn.commit()
-            conn.close()
 
             return jsonify({
                 'status': 'success',
@@ -598,14 +675,11 @@ def analyze_uploaded_image():
             ]
 
             # Cập nhật kết quả phân tích vào database
-            conn = sqlite3.connect("database.db")
-            c = conn.cursor()
-            c.execute(
+            db.execute(
                 "UPDATE leaf_images SET analysis = ? WHERE image = ?",
-                (str(analysis_results), filename)
+                (str(analysis_results), filename),
+                label="leaf_images_update"
             )
-            conn.commit()
-            conn.close()
 
             return jsonify({
                 'status': 'success',
@@ -660,14 +734,11 @@ def upload_file_from_computer():
             f"Image uploaded from computer: {filename}, Size: {len(image_data)} bytes")
 
         # Lưu vào database
-        conn = sqlite3.connect("database.db")
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (datetime('now'), ?, ?)",
-            (filename, 'Uploaded from computer')
+        db.execute(
+            "INSERT INTO leaf_images (timestamp, image, analysis) VALUES (?, ?, ?)",
+            (now_ms(), filename, 'Uploaded from computer'),
+            label="leaf_images_insert"
         )
-        conn.commit()
-        conn.close()
 
         return jsonify({
             'status': 'success',
@@ -714,14 +785,11 @@ def upload_from_esp32():
         print(f"ESP32 auto upload saved: {filename} ({len(image_data)} bytes)")
 
         # Lưu vào database
-        conn = sqlite3.connect("database.db")
-        c = conn.cursor()
-        c.execute(
-            "INSERT INTO leaf_images (timestamp, image) VALUES (datetime('now'), ?)",
-            (filename,)
+        db.execute(
+            "INSERT INTO leaf_images (timestamp, image) VALUES (?, ?)",
+            (now_ms(), filename),
+            label="leaf_images_insert"
         )
-        conn.commit()
-        conn.close()
 
         return jsonify({
             'status': 'success',
@@ -910,37 +978,20 @@ def get_servo_status():
 
 @app.route('/api/devices/status')
 def get_devices_status():
-    """Get recent device status history"""
+    """Get current device states and recent status history"""
     try:
         limit = request.args.get('limit', 50, type=int)
+        device_id = request.args.get('device_id')
 
-        conn = sqlite3.connect("database.db")
-        c = conn.cursor()
-
-        c.execute("""
-            SELECT timestamp, device_type, device_id, status 
-            FROM device_status 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        """, (limit,))
-
-        rows = c.fetchall()
-        conn.close()
-
-        # Convert to list of dictionaries
-        device_history = []
-        for row in rows:
-            device_history.append({
-                'timestamp': row[0],
-                'device_type': row[1],
-                'device_id': row[2],
-                'status': row[3]
-            })
+        # Trạng thái hiện tại lấy từ bộ nhớ, lịch sử đọc từ bảng device_status
+        device_history = device_manager.get_history(device_id, limit)
 
         return jsonify({
             'status': 'success',
+            'current': device_manager.get_all_states(),
             'devices': device_history,
-            'count': len(device_history)
+            'count': len(device_history),
+            'writer': device_manager.writer.stats()
         })
 
     except Exception as e:
@@ -950,21 +1001,15 @@ def get_devices_status():
         }), 500
 
 
-from logger_config import smart_garden_logger as logger
-
 @app.route('/api/smart-control', methods=['POST'])
 def smart_control():
     try:
         logger.info("Smart control request received")
         # Get latest analysis
-        conn = sqlite3.connect("database.db")
-        c = conn.cursor()
-        c.execute("""
+        analysis = db.query_one("""
             SELECT analysis FROM leaf_images 
             ORDER BY timestamp DESC LIMIT 1
-        """)
-        analysis = c.fetchone()
-        conn.close()
+        """, label="latest_analysis")
 
         if not analysis:
             return jsonify({
@@ -1014,5 +1059,8 @@ def smart_control():
 
 
 if __name__ == "__main__":
-    init_db()
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    debug = True
+    # Tiến trình cha của reloader chỉ theo dõi file, không khởi động dịch vụ nền
+    if not debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        start_services()
+    app.run(host="0.0.0.0", port=5000, debug=debug)
@@ -0,0 +1,216 @@
+"""Benchmark truy vấn lịch sử trên lược đồ cũ (timestamp TEXT, không index)
+và lược đồ mới (epoch ms, index bao phủ).
+
+Tạo một DB tạm với ``--rows`` dòng sensor_data (mặc định 10 triệu, trải đều
+trong ``--days`` ngày) và ``--rows / 10`` dòng device_status ở lược đồ cũ,
+đo các truy vấn của app, chuyển đổi bằng ``schema.init_schema`` (đo luôn
+thời gian chuyển, gồm cả dựng bảng tổng hợp) rồi đo lại các truy vấn tương
+ứng trên lược đồ mới. ``history_30d`` so sánh việc đọc toàn bộ số liệu thô
+30 ngày với đọc bảng tổng hợp 1 giờ.
+
+Cách dùng (chạy trong thư mục ``esp``)::
+
+    python bench_db.py --rows 10000000 --json-out bench_db.json
+    python bench_db.py --rows 1000000 --repeats 20
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict
+
+from schema import init_schema
+
+DEVICES = ("fan1", "pump1", "cover1", "light1")
+
+
+def build_legacy_db(path: str, rows: int, days: int):
+    """Sinh dữ liệu ngay trong SQLite (CTE đệ quy) để không phải đẩy từng dòng qua Python"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("CREATE TABLE sensor_data (timestamp TEXT, temperature REAL, humidity REAL, light REAL, moisture INTEGER)")
+    conn.execute("CREATE TABLE leaf_images (timestamp TEXT, image TEXT, analysis TEXT)")
+    conn.execute("CREATE TABLE device_status (timestamp TEXT, device_type TEXT, device_id TEXT, status TEXT)")
+    end = int(time.time())
+    start = end - days * 86400
+    with conn:
+        conn.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO sensor_data
+            SELECT strftime('%Y-%m-%d %H:%M:%S', ? + i * ? / ?, 'unixepoch'),
+                   20 + (i % 150) / 10.0, 40 + (i % 400) / 10.0, i % 1000, i % 100
+            FROM seq
+        """, (rows - 1, start, end - start, rows))
+        device_rows = max(1, rows // 10)
+        conn.execute("""
+            WITH RECURSIVE seq(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM seq WHERE i < ?)
+            INSERT INTO device_status
+            SELECT strftime('%Y-%m-%d %H:%M:%S', ? + i * ? / ?, 'unixepoch'),
+                   'Motor', 'dev' || (i % ?), CASE i % 2 WHEN 0 THEN 'OPEN' ELSE 'CLOSED' END
+            FROM seq
+        """, (device_rows - 1, start, end - start, device_rows, len(DEVICES)))
+        # Tên thiết bị thật thay cho 'dev0'.. để truy vấn giống app
+        for i, device_id in enumerate(DEVICES):
+            conn.execute("UPDATE device_status SET device_id = ? WHERE device_id = ?", (device_id, f"dev{i}"))
+    conn.close()
+
+
+def measure(conn: sqlite3.Connection, sql: str, params, repeats: int) -> Dict:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = conn.execute(sql, params).fetchall()
+        timings.append((time.perf_counter() - started) * 1000.0)
+    plan = " | ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params))
+    return {
+        "p50_ms": statistics.median(timings),
+        "max_ms": max(timings),
+        "rows": len(result),
+        "plan": plan,
+    }
+
+
+def legacy_queries(hours: int, limit: int) -> Dict[str, tuple]:
+    return {
+        "history_recent": ("""
+            SELECT timestamp, temperature, humidity, light, moisture
+            FROM sensor_data
+            WHERE datetime(timestamp) >= datetime('now', '-{} hours')
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """.format(hours), (limit,)),
+        "history_window_count": ("""
+            SELECT COUNT(*), AVG(temperature) FROM sensor_data
+            WHERE datetime(timestamp) >= datetime('now', '-{} hours')
+        """.format(hours), ()),
+        "history_30d": ("""
+            SELECT timestamp, temperature, humidity, light, moisture
+            FROM sensor_data
+            WHERE datetime(timestamp) >= datetime('now', '-720 hours')
+            ORDER BY timestamp DESC
+        """, ()),
+        "device_recover": ("""
+            SELECT device_id, device_type, status, MAX(timestamp)
+            FROM device_status GROUP BY device_id
+        """, ()),
+        "device_history": ("""
+            SELECT timestamp, device_type, device_id, status
+            FROM device_status WHERE device_id = ?
+            ORDER BY timestamp DESC LIMIT ?
+        """, ("pump1", limit)),
+    }
+
+
+def new_queries(hours: int, limit: int) -> Dict[str, tuple]:
+    end = int(time.time() * 1000)
+    start = end - hours * 3600 * 1000
+    return {
+        "history_recent": ("""
+            SELECT timestamp, temperature, humidity, light, moisture
+            FROM sensor_data
+            WHERE timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        """, (start, end, limit)),
+        "history_window_count": ("""
+            SELECT COUNT(*), AVG(temperature) FROM sensor_data
+            WHERE timestamp >= ? AND timestamp <= ?
+        """, (start, end)),
+        # 30 ngày ở độ phân giải 1 giờ: 720 khoảng x 4 cảm biến dù có bao nhiêu số liệu thô
+        "history_30d": ("""
+            SELECT bucket, sensor, count, sum, min, max
+            FROM sensor_rollup_1h
+            WHERE bucket >= ? AND bucket <= ?
+            ORDER BY bucket DESC
+        """, (end - 720 * 3600 * 1000, end)),
+        "device_recover": ("""
+            WITH RECURSIVE ids(device_id) AS (
+                SELECT MIN(device_id) FROM device_status
+                UNION ALL
+                SELECT (SELECT MIN(device_id) FROM device_status WHERE device_id > ids.device_id)
+                FROM ids WHERE ids.device_id IS NOT NULL
+            )
+            SELECT d.device_id, d.device_type, d.status, d.controller, d.timestamp
+            FROM ids JOIN device_status d ON d.rowid = (
+                SELECT rowid FROM device_status
+                WHERE device_id = ids.device_id
+                ORDER BY timestamp DESC LIMIT 1
+            )
+        """, ()),
+        "device_history": ("""
+            SELECT timestamp, device_type, device_id, status, controller
+            FROM device_status WHERE device_id = ?
+            ORDER BY timestamp DESC LIMIT ?
+        """, ("pump1", limit)),
+    }
+
+
+def run_queries(path: str, queries: Dict, repeats: int) -> Dict:
+    conn = sqlite3.connect(path)
+    try:
+        return {name: measure(conn, sql, params, repeats) for name, (sql, params) in queries.items()}
+    finally:
+        conn.close()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="So sánh truy vấn lịch sử trước và sau khi chuyển lược đồ")
+    parser.add_argument("--rows", type=int, default=10_000_000, help="Số dòng sensor_data")
+    parser.add_argument("--days", type=int, default=365, help="Khoảng thời gian trải dữ liệu")
+    parser.add_argument("--hours", type=int, default=24, help="Cửa sổ của truy vấn lịch sử")
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--dir", help="Thư mục chứa DB tạm (mặc định thư mục tạm của hệ thống)")
+    parser.add_argument("--json-out", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        path = os.path.join(tmp, "bench.db")
+        print(f"Tạo {args.rows:,} dòng sensor_data ở lược đồ cũ...")
+        started = time.perf_counter()
+        build_legacy_db(path, args.rows, args.days)
+        build_seconds = time.perf_counter() - started
+
+        legacy = run_queries(path, legacy_queries(args.hours, args.limit), args.repeats)
+
+        conn = sqlite3.connect(path)
+        started = time.perf_counter()
+        migration = init_schema(conn)
+        migrate_seconds = time.perf_counter() - started
+        conn.close()
+
+        migrated = run_queries(path, new_queries(args.hours, args.limit), args.repeats)
+        db_mb = os.path.getsize(path) / 1e6
+
+    report = {
+        "rows": args.rows,
+        "days": args.days,
+        "hours": args.hours,
+        "build_seconds": build_seconds,
+        "migrate_seconds": migrate_seconds,
+        "migration": migration,
+        "db_size_mb": db_mb,
+        "legacy": legacy,
+        "migrated": migrated,
+    }
+    print(f"Chuyển đổi: {migrate_seconds:.1f}s, DB sau chuyển đổi {db_mb:.0f} MB")
+    print(f"{'truy vấn':<22}{'cũ p50 (ms)':>14}{'mới p50 (ms)':>14}{'nhanh hơn':>12}")
+    for name in legacy:
+        old_ms, new_ms = legacy[name]["p50_ms"], migrated[name]["p50_ms"]
+        print(f"{name:<22}{old_ms:>14.2f}{new_ms:>14.3f}{old_ms / max(new_ms, 1e-6):>11.0f}x")
+    for name, result in migrated.items():
+        print(f"  {name}: {result['plan']}")
+
+    if args.json_out:
+        with open(args.json_out, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,158 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+DATABASE_PATH = os.getenv("DATABASE_PATH", "database.db")
+# Thời gian chờ khi DB đang bị khóa ghi (ms) và số lần thử lại sau đó
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_BUSY_RETRIES = int(os.getenv("DB_BUSY_RETRIES", "3"))
+# Dung lượng cache trang của mỗi kết nối (KB) và số kết nối rảnh giữ lại
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "8192"))
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+
+
+class Database:
+    """Truy cập SQLite dùng chung cho app, các writer nền và DeviceStateManager.
+
+    Kết nối được giữ trong một pool: mỗi luồng mượn riêng một kết nối trong
+    lúc chạy truy vấn rồi trả lại, nên các request ngắn của Flask không phải
+    mở kết nối mới. Kết nối mở ở chế độ WAL (đọc không chặn ghi) với
+    ``synchronous=NORMAL``, cache lớn hơn mặc định và busy timeout; sqlite3
+    tự giữ câu lệnh đã biên dịch theo chuỗi SQL trên từng kết nối. Khi vẫn
+    gặp "database is locked" sau busy timeout, truy vấn được thử lại vài lần.
+    Thời gian mỗi câu lệnh được cộng dồn theo ``label`` để xem qua ``stats``.
+    """
+
+    def __init__(self, path: str = DATABASE_PATH, busy_timeout_ms: int = DB_BUSY_TIMEOUT_MS,
+                 busy_retries: int = DB_BUSY_RETRIES, cache_size_kb: int = DB_CACHE_SIZE_KB,
+                 pool_size: int = DB_POOL_SIZE, cached_statements: int = 128):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.busy_retries = busy_retries
+        self.cache_size_kb = cache_size_kb
+        self.cached_statements = cached_statements
+        self._pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=max(1, pool_size))
+        self._lock = threading.Lock()
+        self._opened = 0
+        self._busy_retries = 0
+        self._stats: Dict[str, Dict] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{self.cache_size_kb}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        with self._lock:
+            self._opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Mượn một kết nối trong pool, trả lại khi xong"""
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def _run(self, label: str, action):
+        started = time.perf_counter()
+        error = False
+        try:
+            for attempt in range(self.busy_retries + 1):
+                try:
+                    with self.connection() as conn:
+                        return action(conn)
+                except sqlite3.OperationalError as e:
+                    if ("locked" not in str(e) and "busy" not in str(e)) or attempt == self.busy_retries:
+                        raise
+                    with self._lock:
+                        self._busy_retries += 1
+                    time.sleep(0.05 * (attempt + 1))
+        except Exception:
+            error = True
+            raise
+        finally:
+            self._record(label, (time.perf_counter() - started) * 1000.0, error)
+
+    def query(self, sql: str, params: Sequence = (), label: Optional[str] = None) -> List[tuple]:
+        """Chạy câu SELECT, trả về toàn bộ các dòng"""
+        return self._run(label or sql, lambda conn: conn.execute(sql, params).fetchall())
+
+    def query_one(self, sql: str, params: Sequence = (), label: Optional[str] = None) -> Optional[tuple]:
+        return self._run(label or sql, lambda conn: conn.execute(sql, params).fetchone())
+
+    def execute(self, sql: str, params: Sequence = (), label: Optional[str] = None) -> int:
+        """Chạy một câu ghi trong transaction riêng, trả về số dòng bị ảnh hưởng"""
+        def action(conn):
+            with conn:
+                return conn.execute(sql, params).rowcount
+        return self._run(label or sql, action)
+
+    def executemany(self, sql: str, rows: Iterable[Sequence], label: Optional[str] = None) -> int:
+        """Ghi nhiều dòng trong một transaction"""
+        rows = list(rows)
+
+        def action(conn):
+            with conn:
+                return conn.executemany(sql, rows).rowcount
+        return self._run(label or sql, action)
+
+    def transaction(self, action: Callable[[sqlite3.Connection], Any], label: str) -> Any:
+        """Chạy ``action(conn)`` trong một transaction, ví dụ nhiều câu ghi cần đi cùng nhau"""
+        def run(conn):
+            with conn:
+                return action(conn)
+        return self._run(label, run)
+
+    def _record(self, label: str, elapsed_ms: float, error: bool):
+        label = " ".join(label.split())
+        with self._lock:
+            entry = self._stats.get(label)
+            if entry is None:
+                entry = self._stats[label] = {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0}
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            queries = {
+                label: {**entry, "avg_ms": entry["total_ms"] / entry["count"] if entry["count"] else 0.0}
+                for label, entry in self._stats.items()
+            }
+            return {
+                "path": self.path,
+                "connections_opened": self._opened,
+                "idle_connections": self._pool.qsize(),
+                "busy_retries": self._busy_retries,
+                "queries": queries,
+            }
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                break
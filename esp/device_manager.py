@@ -1,31 +1,126 @@
-from datetime import datetime
 import threading
-from typing import Dict, Optional
+from typing import Dict, List, Optional
+
+from db import Database
+from schema import now_ms
+from sensor_writer import BatchWriter
 
 class DeviceStateManager:
-    def __init__(self):
+    """Trạng thái hiện tại của các thiết bị, dùng chung cho app và SmartController.
+
+    Mỗi lần đổi trạng thái được ghi thêm (không sửa) vào bảng device_status
+    qua một BatchWriter. Khi khởi động, ``recover`` dựng lại trạng thái hiện
+    tại từ bản ghi mới nhất của từng thiết bị.
+    """
+
+    def __init__(self, db: Optional[Database] = None, batch_size: int = 20,
+                 flush_interval: float = 1.0, max_buffer: int = 1000):
         self._states: Dict[str, Dict] = {}
         self._lock = threading.Lock()
-        
-    def set_device_state(self, device_id: str, state: str, 
-                        controller: str = "raspberry"):
+        self.db = db
+        self.writer: Optional[BatchWriter] = None
+        if db:
+            self.writer = BatchWriter(
+                "INSERT INTO device_status (timestamp, device_type, device_id, status, controller) "
+                "VALUES (?, ?, ?, ?, ?)",
+                db, batch_size, flush_interval, max_buffer, name="device-status-writer",
+            )
+
+    def start(self):
+        if self.writer:
+            self.writer.start()
+
+    def close(self):
+        if self.writer:
+            self.writer.stop()
+
+    def recover(self) -> int:
+        """Nạp trạng thái cuối của từng thiết bị từ device_status, trả về số thiết bị"""
+        if not self.db:
+            return 0
+        # Nhảy qua từng device_id trên index (device_id, timestamp, ...) và chỉ đọc
+        # dòng mới nhất của mỗi thiết bị, không quét toàn bộ lịch sử
+        rows = self.db.query("""
+            WITH RECURSIVE ids(device_id) AS (
+                SELECT MIN(device_id) FROM device_status
+                UNION ALL
+                SELECT (SELECT MIN(device_id) FROM device_status WHERE device_id > ids.device_id)
+                FROM ids WHERE ids.device_id IS NOT NULL
+            )
+            SELECT d.device_id, d.device_type, d.status, d.controller, d.timestamp
+            FROM ids JOIN device_status d ON d.rowid = (
+                SELECT rowid FROM device_status
+                WHERE device_id = ids.device_id
+                ORDER BY timestamp DESC LIMIT 1
+            )
+        """, label="device_status_recover")
         with self._lock:
+            for device_id, device_type, status, controller, timestamp in rows:
+                # Trạng thái mới hơn đã nhận trong lúc khôi phục thì giữ nguyên
+                if device_id not in self._states:
+                    self._states[device_id] = {
+                        "state": status,
+                        "controller": controller or "raspberry",
+                        "device_type": device_type,
+                        "timestamp": timestamp,
+                    }
+        return len(rows)
+
+    def set_device_state(self, device_id: str, state: str,
+                        controller: str = "raspberry", device_type: Optional[str] = None):
+        timestamp = now_ms()
+        with self._lock:
+            previous = self._states.get(device_id)
+            if device_type is None and previous:
+                device_type = previous.get("device_type")
             self._states[device_id] = {
                 "state": state,
                 "controller": controller,
-                "timestamp": datetime.now()
+                "device_type": device_type,
+                "timestamp": timestamp,
             }
-            
+        if self.writer:
+            self.writer.add((timestamp, device_type, device_id, state, controller))
+
     def get_device_state(self, device_id: str) -> Optional[Dict]:
         with self._lock:
             return self._states.get(device_id)
-            
+
+    def get_all_states(self) -> Dict[str, Dict]:
+        with self._lock:
+            return {device_id: dict(state) for device_id, state in self._states.items()}
+
+    def get_history(self, device_id: Optional[str] = None, limit: int = 50) -> List[Dict]:
+        """Lịch sử trạng thái mới nhất trước, chỉ gồm các bản ghi đã ghi xuống DB"""
+        if not self.db:
+            return []
+        if device_id:
+            rows = self.db.query("""
+                SELECT timestamp, device_type, device_id, status, controller
+                FROM device_status
+                WHERE device_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (device_id, limit), label="device_status_history")
+        else:
+            rows = self.db.query("""
+                SELECT timestamp, device_type, device_id, status, controller
+                FROM device_status
+                ORDER BY timestamp DESC
+                LIMIT ?
+            """, (limit,), label="device_status_history")
+        return [
+            {"timestamp": row[0], "device_type": row[1], "device_id": row[2],
+             "status": row[3], "controller": row[4]}
+            for row in rows
+        ]
+
     def is_device_free(self, device_id: str) -> bool:
         with self._lock:
             if device_id not in self._states:
                 return True
             state = self._states[device_id]
-            if (state["controller"] == "raspberry" and 
+            if (state["controller"] == "raspberry" and
                 state["state"] == "OPEN"):
                 return False
             return True
@@ -0,0 +1,184 @@
+"""Bảng tổng hợp số liệu cảm biến theo phút, giờ và ngày.
+
+Mỗi bảng ``sensor_rollup_<độ phân giải>`` giữ count/sum/min/max của từng
+cảm biến trong mỗi khoảng (``bucket`` là epoch ms đầu khoảng). Khoảng được
+căn theo giờ địa phương của vườn (``ROLLUP_TZ_OFFSET``, mặc định +07:00),
+nên mỗi khoảng 1d là một ngày từ 00:00 tới 00:00 giờ địa phương. Khi
+SensorWriter ghi một lô, ``update_rollups`` gộp lô đó trong bộ nhớ rồi
+upsert vào cả ba bảng trong cùng transaction, nên truy vấn lịch sử dài chỉ
+đọc số dòng cố định thay vì toàn bộ số liệu thô.
+"""
+import os
+from numbers import Real
+from typing import Dict, Iterable, List, Tuple
+
+SENSORS = ("temperature", "humidity", "light", "moisture")
+
+# Độ phân giải -> độ dài mỗi khoảng (ms), từ mịn tới thô
+RESOLUTIONS = {
+    "1m": 60 * 1000,
+    "1h": 3600 * 1000,
+    "1d": 86400 * 1000,
+}
+
+
+def parse_utc_offset(text: str) -> int:
+    """Độ lệch so với UTC dạng ``+07:00``/``-05:30``/``+7`` -> số phút"""
+    sign = text[:1]
+    hours, _, minutes = text[1:].partition(":")
+    if sign not in ("+", "-") or not hours.isdigit() or (minutes and not minutes.isdigit()):
+        raise ValueError(f"Độ lệch múi giờ không hợp lệ: {text!r} (dùng +HH:MM)")
+    offset = int(hours) * 60 + int(minutes or 0)
+    return offset if sign == "+" else -offset
+
+
+# Múi giờ dùng để căn đầu khoảng (cố định, không có giờ mùa hè); đổi giá trị này thì
+# init_schema dựng lại các bảng tổng hợp
+ROLLUP_TZ_OFFSET = os.getenv("ROLLUP_TZ_OFFSET", "+07:00")
+ROLLUP_OFFSET_MS = parse_utc_offset(ROLLUP_TZ_OFFSET) * 60 * 1000
+
+
+def bucket_start(timestamp: int, step_ms: int) -> int:
+    """Epoch ms đầu khoảng chứa ``timestamp``, căn theo giờ địa phương"""
+    return (timestamp + ROLLUP_OFFSET_MS) // step_ms * step_ms - ROLLUP_OFFSET_MS
+
+
+def rollup_table(resolution: str) -> str:
+    return f"sensor_rollup_{resolution}"
+
+
+def _upsert_sql(table: str) -> str:
+    return f"""
+        INSERT INTO {table} (bucket, sensor, count, sum, min, max)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (bucket, sensor) DO UPDATE SET
+            count = count + excluded.count,
+            sum = sum + excluded.sum,
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max)
+    """
+
+
+def aggregate(readings: Iterable[Tuple[int, str, float]], step_ms: int) -> Dict[Tuple[int, str], List]:
+    """Gộp (timestamp, sensor, value) theo (bucket, sensor) -> [count, sum, min, max]"""
+    groups: Dict[Tuple[int, str], List] = {}
+    for timestamp, sensor, value in readings:
+        key = (bucket_start(timestamp, step_ms), sensor)
+        entry = groups.get(key)
+        if entry is None:
+            groups[key] = [1, value, value, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+            entry[2] = min(entry[2], value)
+            entry[3] = max(entry[3], value)
+    return groups
+
+
+def update_rollups(conn, readings: List[Tuple[int, str, float]]):
+    """Cộng các số liệu mới vào mọi bảng tổng hợp (gọi trong transaction đang mở)"""
+    # Bỏ giá trị không phải số (cảm biến lỗi có thể gửi null hoặc chuỗi)
+    readings = [r for r in readings if isinstance(r[2], Real) and not isinstance(r[2], bool)]
+    if not readings:
+        return
+    for resolution, step_ms in RESOLUTIONS.items():
+        groups = aggregate(readings, step_ms)
+        conn.executemany(
+            _upsert_sql(rollup_table(resolution)),
+            [(bucket, sensor, *values) for (bucket, sensor), values in groups.items()],
+        )
+
+
+def rebuild_rollups(conn):
+    """Dựng lại các bảng tổng hợp từ sensor_data (gọi trong transaction đang mở)
+
+    Dòng sensor_data cũ không cho biết cảm biến nào vừa gửi số liệu nên mọi
+    cột của mỗi dòng đều được tính. Số liệu thô chỉ được quét một lần vào
+    bảng tạm theo phút (mỗi dòng gồm cả bốn cảm biến), bảng tạm thô hơn được
+    gộp từ bảng tạm mịn hơn, rồi mỗi bảng tạm được tách theo cảm biến và chèn
+    theo thứ tự khóa chính.
+    """
+    source, first = "sensor_data", True
+    for resolution, step_ms in RESOLUTIONS.items():
+        if first:
+            columns = ", ".join(
+                f"COUNT({s}) AS {s}_count, SUM({s}) AS {s}_sum, MIN({s}) AS {s}_min, MAX({s}) AS {s}_max"
+                for s in SENSORS
+            )
+            bucket = "timestamp"
+        else:
+            columns = ", ".join(
+                f"SUM({s}_count) AS {s}_count, SUM({s}_sum) AS {s}_sum, "
+                f"MIN({s}_min) AS {s}_min, MAX({s}_max) AS {s}_max"
+                for s in SENSORS
+            )
+            bucket = "bucket"
+        staging = f"rollup_rebuild_{resolution}"
+        conn.execute(f"DROP TABLE IF EXISTS temp.{staging}")
+        conn.execute(f"""
+            CREATE TEMP TABLE {staging} AS
+            SELECT ({bucket} + {ROLLUP_OFFSET_MS}) / {step_ms} * {step_ms} - {ROLLUP_OFFSET_MS} AS bucket, {columns}
+            FROM {source}
+            GROUP BY 1
+        """)
+        unpivot = " UNION ALL ".join(
+            f"SELECT bucket, '{s}', {s}_count, {s}_sum, {s}_min, {s}_max FROM {staging} WHERE {s}_count > 0"
+            for s in SENSORS
+        )
+        conn.execute(f"DELETE FROM {rollup_table(resolution)}")
+        conn.execute(f"""
+            INSERT INTO {rollup_table(resolution)} (bucket, sensor, count, sum, min, max)
+            SELECT * FROM ({unpivot}) ORDER BY 1, 2
+        """)
+        if not first:
+            conn.execute(f"DROP TABLE temp.{source}")
+        source, first = staging, False
+    conn.execute(f"DROP TABLE temp.{source}")
+
+
+def rollups_aligned(conn) -> bool:
+    """Các bảng tổng hợp có được căn theo ROLLUP_TZ_OFFSET hiện tại không
+
+    Bảng 1m luôn khớp với độ lệch tròn phút nên chỉ kiểm tra các bảng thô hơn
+    (nhỏ, quét nhanh).
+    """
+    for resolution, step_ms in RESOLUTIONS.items():
+        if step_ms <= RESOLUTIONS["1m"]:
+            continue
+        misaligned = conn.execute(
+            f"SELECT 1 FROM {rollup_table(resolution)} WHERE (bucket + ?) % ? != 0 LIMIT 1",
+            (ROLLUP_OFFSET_MS, step_ms),
+        ).fetchone()
+        if misaligned:
+            return False
+    return True
+
+
+def choose_resolution(window_ms: int, max_points: int, raw_max_ms: int) -> str:
+    """Độ phân giải mịn nhất mà cửa sổ ``window_ms`` không vượt ``max_points`` khoảng"""
+    if window_ms <= raw_max_ms:
+        return "raw"
+    for resolution, step_ms in RESOLUTIONS.items():
+        if window_ms / step_ms <= max_points:
+            return resolution
+    return list(RESOLUTIONS)[-1]
+
+
+def query_rollups(db, resolution: str, start: int, end: int, limit: int) -> List[Dict]:
+    """Tối đa ``limit`` khoảng mới nhất trong [start, end], mỗi khoảng gồm min/max/avg/count từng cảm biến"""
+    step_ms = RESOLUTIONS[resolution]
+    # Mỗi khoảng có tối đa len(SENSORS) dòng, nên limit * len(SENSORS) dòng đầu
+    # chứa trọn ``limit`` khoảng mới nhất
+    rows = db.query(f"""
+        SELECT bucket, sensor, count, sum, min, max
+        FROM {rollup_table(resolution)}
+        WHERE bucket >= ? AND bucket <= ?
+        ORDER BY bucket DESC
+        LIMIT ?
+    """, (bucket_start(start, step_ms), end, max(0, limit) * len(SENSORS)), label=f"sensor_history_{resolution}")
+
+    points: Dict[int, Dict] = {}
+    for bucket, sensor, count, total, low, high in rows:
+        point = points.setdefault(bucket, {"timestamp": bucket})
+        point[sensor] = {"min": low, "max": high, "avg": total / count if count else None, "count": count}
+    return list(points.values())[:max(0, limit)]
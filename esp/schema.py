@@ -0,0 +1,219 @@
+"""Lược đồ SQLite của app và bước chuyển đổi từ lược đồ cũ.
+
+Mọi bảng lưu thời gian ở cột ``timestamp`` kiểu INTEGER (epoch mili giây,
+UTC) để lọc theo khoảng thời gian bằng so sánh số trên index, thay vì gọi
+``datetime(timestamp)`` trên từng dòng. Lược đồ cũ lưu ``timestamp TEXT``
+("YYYY-MM-DD HH:MM:SS" UTC) và không có index.
+
+Riêng ``device_status`` cũ được ghi bằng ``datetime.now().isoformat()``
+nên là giờ địa phương không kèm múi giờ; khi chuyển đổi, mặc định coi là
+giờ địa phương của máy đang chạy (đúng khi chuyển trên chính máy đã ghi DB),
+hoặc chỉ rõ bằng ``--source-tz``.
+
+``init_schema`` tạo bảng/index nếu chưa có và tự chuyển đổi DB cũ. Có thể
+chuyển đổi riêng một lần (app đang dừng), kèm bản sao lưu::
+
+    python schema.py --db database.db
+    python schema.py --db database.db --source-tz +07:00
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from typing import Dict
+
+from rollup import RESOLUTIONS, parse_utc_offset, rebuild_rollups, rollup_table, rollups_aligned
+
+TABLES = {
+    "sensor_data": """CREATE TABLE IF NOT EXISTS sensor_data (
+        timestamp INTEGER NOT NULL,
+        temperature REAL,
+        humidity REAL,
+        light REAL,
+        moisture INTEGER
+    )""",
+    "leaf_images": """CREATE TABLE IF NOT EXISTS leaf_images (
+        timestamp INTEGER NOT NULL,
+        image TEXT,
+        analysis TEXT
+    )""",
+    # Lịch sử trạng thái thiết bị, chỉ ghi thêm
+    "device_status": """CREATE TABLE IF NOT EXISTS device_status (
+        timestamp INTEGER NOT NULL,
+        device_type TEXT,
+        device_id TEXT,
+        status TEXT,
+        controller TEXT
+    )""",
+}
+# Bảng tổng hợp theo phút/giờ/ngày (xem rollup.py), khóa chính (bucket, sensor)
+for _resolution in RESOLUTIONS:
+    TABLES[rollup_table(_resolution)] = f"""CREATE TABLE IF NOT EXISTS {rollup_table(_resolution)} (
+        bucket INTEGER NOT NULL,
+        sensor TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        sum REAL NOT NULL,
+        min REAL,
+        max REAL,
+        PRIMARY KEY (bucket, sensor)
+    ) WITHOUT ROWID"""
+
+INDEXES = [
+    # Bao phủ truy vấn lịch sử cảm biến: đọc thẳng từ index, không quay lại bảng
+    "CREATE INDEX IF NOT EXISTS idx_sensor_data_time "
+    "ON sensor_data (timestamp, temperature, humidity, light, moisture)",
+    "CREATE INDEX IF NOT EXISTS idx_leaf_images_time ON leaf_images (timestamp)",
+    "CREATE INDEX IF NOT EXISTS idx_leaf_images_image ON leaf_images (image)",
+    # Bao phủ khôi phục trạng thái cuối và lịch sử từng thiết bị
+    "CREATE INDEX IF NOT EXISTS idx_device_status_device_time "
+    "ON device_status (device_id, timestamp, status, controller, device_type)",
+    "CREATE INDEX IF NOT EXISTS idx_device_status_time ON device_status (timestamp)",
+]
+
+# TEXT -> epoch mili giây, ``modifiers`` đổi giờ đọc được sang UTC; NULL nếu không đọc được
+TEXT_TO_MS = "CAST(ROUND((julianday({column}{modifiers}) - 2440587.5) * 86400000) AS INTEGER)"
+
+# Bảng cũ lưu giờ địa phương (datetime.now().isoformat()), các bảng khác lưu UTC
+LOCAL_TIME_TABLES = ("device_status",)
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> Dict[str, str]:
+    return {row[1]: (row[2] or "").upper() for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def legacy_tables(conn: sqlite3.Connection):
+    """Các bảng còn lưu timestamp dạng TEXT"""
+    return [table for table in TABLES if _columns(conn, table).get("timestamp") == "TEXT"]
+
+
+def source_tz_modifiers(source_tz: str) -> str:
+    """Modifier của julianday đổi giờ ``source_tz`` sang UTC
+
+    ``source_tz`` là ``local`` (múi giờ của máy đang chạy, kể cả giờ mùa hè),
+    ``utc`` hoặc độ lệch cố định so với UTC dạng ``+07:00``/``-05:30``.
+    """
+    if source_tz == "local":
+        return ", 'utc'"
+    if source_tz.lower() in ("utc", "z", "+00:00", "-00:00"):
+        return ""
+    try:
+        offset = parse_utc_offset(source_tz)
+    except ValueError:
+        raise ValueError(f"Múi giờ không hợp lệ: {source_tz!r} (dùng local, utc hoặc +HH:MM)")
+    # Giờ địa phương = UTC + offset, nên UTC = giờ địa phương - offset
+    return f", '{-offset:+d} minutes'"
+
+
+def migrate_table(conn: sqlite3.Connection, table: str, source_tz: str = "local") -> Dict[str, int]:
+    """Chép bảng cũ sang bảng mới với timestamp epoch ms (cần gọi trong transaction)
+
+    Bảng trong LOCAL_TIME_TABLES được đổi từ giờ ``source_tz`` sang UTC.
+    Index cũ đi theo bảng khi đổi tên nên bị xóa cùng bảng cũ.
+    """
+    to_ms = TEXT_TO_MS.format(
+        column="timestamp",
+        modifiers=source_tz_modifiers(source_tz) if table in LOCAL_TIME_TABLES else "",
+    )
+    old_columns = _columns(conn, table)
+    total = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    conn.execute(TABLES[table])
+    new_columns = list(_columns(conn, table))
+    select = [
+        to_ms if column == "timestamp"
+        else (column if column in old_columns else "NULL")
+        for column in new_columns
+    ]
+    conn.execute(
+        f"INSERT INTO {table} ({', '.join(new_columns)}) "
+        f"SELECT {', '.join(select)} FROM {table}_legacy "
+        f"WHERE {to_ms} IS NOT NULL"
+    )
+    migrated = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    conn.execute(f"DROP TABLE {table}_legacy")
+    return {"rows": total, "migrated": migrated, "skipped": total - migrated}
+
+
+def init_schema(conn: sqlite3.Connection, source_tz: str = "local") -> Dict[str, Dict[str, int]]:
+    """Tạo bảng và index, chuyển đổi các bảng cũ; trả về số dòng đã chuyển theo bảng
+
+    ``source_tz`` là múi giờ của device_status cũ (xem ``source_tz_modifiers``).
+    ``sensor_rollups`` có mặt khi các bảng tổng hợp vừa được dựng từ sensor_data.
+    """
+    source_tz_modifiers(source_tz)  # báo lỗi múi giờ trước khi đụng vào DB
+    report = {}
+    with conn:
+        # DDL không tự mở transaction trong sqlite3, mở tay để chuyển đổi trọn vẹn hoặc không gì cả
+        conn.execute("BEGIN IMMEDIATE")
+        for table in legacy_tables(conn):
+            report[table] = migrate_table(conn, table, source_tz)
+        has_rollups = bool(_columns(conn, rollup_table(next(iter(RESOLUTIONS)))))
+        for ddl in TABLES.values():
+            conn.execute(ddl)
+        # Lần đầu có bảng tổng hợp, hoặc bảng cũ căn theo múi giờ khác: dựng từ số liệu
+        # thô đã có, sau đó SensorWriter cập nhật dần
+        rebuild = not has_rollups or not rollups_aligned(conn)
+        raw_rows = conn.execute("SELECT COUNT(*) FROM sensor_data").fetchone()[0] if rebuild else 0
+        if raw_rows:
+            rebuild_rollups(conn)
+            report["sensor_rollups"] = {"rows": raw_rows, "migrated": raw_rows, "skipped": 0}
+        # Bảng device_status tạo trước khi có cột controller
+        if "controller" not in _columns(conn, "device_status"):
+            conn.execute("ALTER TABLE device_status ADD COLUMN controller TEXT")
+        for ddl in INDEXES:
+            conn.execute(ddl)
+    if report:
+        conn.execute("ANALYZE")
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Chuyển DB sang lược đồ timestamp epoch ms có index")
+    parser.add_argument("--db", default="database.db")
+    parser.add_argument("--no-backup", action="store_true", help="Không sao lưu DB trước khi chuyển")
+    parser.add_argument(
+        "--source-tz", default="local",
+        help="Múi giờ của timestamp device_status cũ (ghi bằng datetime.now(), không kèm múi giờ): "
+             "local = múi giờ của máy đang chạy (mặc định, đúng khi chuyển trên máy đã ghi DB), "
+             "utc, hoặc độ lệch như +07:00. sensor_data và leaf_images cũ luôn được coi là UTC",
+    )
+    args = parser.parse_args(argv)
+    try:
+        source_tz_modifiers(args.source_tz)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not os.path.exists(args.db):
+        print(f"Không tìm thấy {args.db}")
+        return 1
+    conn = sqlite3.connect(args.db)
+    try:
+        tables = legacy_tables(conn)
+        if tables and not args.no_backup:
+            backup = f"{args.db}.{time.strftime('%Y%m%d_%H%M%S')}.bak"
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            shutil.copy2(args.db, backup)
+            print(f"Đã sao lưu vào {backup}")
+        started = time.perf_counter()
+        report = init_schema(conn, args.source_tz)
+    finally:
+        conn.close()
+
+    if not report:
+        print("DB đã ở lược đồ mới, không cần chuyển đổi")
+    for table, counts in report.items():
+        print(f"{table}: {counts['migrated']}/{counts['rows']} dòng"
+              + (f", bỏ {counts['skipped']} dòng thời gian không hợp lệ" if counts["skipped"] else ""))
+    if report:
+        print(f"Xong trong {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from db import Database
+from rollup import SENSORS, update_rollups
+
+SensorRow = Tuple[int, Optional[float], Optional[float], Optional[float], Optional[int]]
+
+
+class BatchWriter:
+    """Gom bản ghi từ các luồng khác và ghi xuống SQLite theo lô bằng ``insert_sql``.
+
+    ``add`` chỉ thêm vào bộ đệm trong bộ nhớ nên không chặn luồng gọi (ví dụ
+    luồng MQTT). Một luồng nền ghi bộ đệm bằng ``executemany`` trong một
+    transaction mỗi ``flush_interval`` giây, hoặc sớm hơn khi đã đủ
+    ``batch_size`` bản ghi. Khi bộ đệm đầy (``max_buffer``) bản ghi mới bị bỏ
+    và được đếm lại.
+    """
+
+    def __init__(self, insert_sql: str, db: Database, batch_size: int = 50,
+                 flush_interval: float = 2.0, max_buffer: int = 1000, name: str = "batch-writer"):
+        self.insert_sql = insert_sql
+        self.name = name
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.max_buffer = max(self.batch_size, max_buffer)
+        self._buffer: "deque[Sequence]" = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "written": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def add(self, row: Sequence) -> bool:
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self._stats["dropped"] += 1
+                return False
+            self._buffer.append(row)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wakeup.set()
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0):
+        """Dừng luồng nền và ghi nốt phần còn trong bộ đệm"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> int:
+        """Ghi toàn bộ bộ đệm trong một transaction, trả về số bản ghi đã ghi"""
+        with self._flush_lock:
+            with self._lock:
+                rows: List[Sequence] = list(self._buffer)
+                self._buffer.clear()
+            if not rows:
+                return 0
+
+            started = time.perf_counter()
+            try:
+                self.db.transaction(lambda conn: self.write(conn, rows), label=self.name)
+            except sqlite3.Error as e:
+                print(f"Error writing {self.name} batch: {e}")
+                self._requeue(rows)
+                return 0
+            elapsed_ms = (time.perf_counter() - started) * 1000.0
+
+            with self._lock:
+                self._stats["written"] += len(rows)
+                self._stats["flushes"] += 1
+                self._stats["last_flush_rows"] = len(rows)
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+                self._stats["total_flush_ms"] += elapsed_ms
+            return len(rows)
+
+    def write(self, conn: sqlite3.Connection, rows: List[Sequence]):
+        """Ghi một lô trong transaction đang mở; lớp con có thể ghi thêm bảng khác"""
+        conn.executemany(self.insert_sql, rows)
+
+    def _requeue(self, rows: List[Sequence]):
+        # Trả lô lỗi về đầu bộ đệm để lần sau ghi lại, phần vượt sức chứa bị bỏ
+        with self._lock:
+            self._stats["flush_errors"] += 1
+            room = max(0, self.max_buffer - len(self._buffer))
+            kept = rows[len(rows) - room:] if room < len(rows) else rows
+            self._stats["dropped"] += len(rows) - len(kept)
+            self._buffer.extendleft(reversed(kept))
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = len(self._buffer)
+        total_ms = stats.pop("total_flush_ms")
+        stats["avg_flush_ms"] = total_ms / stats["flushes"] if stats["flushes"] else 0.0
+        stats.update({
+            "max_buffer": self.max_buffer,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "running": self._thread is not None and self._thread.is_alive(),
+        })
+        return stats
+
+
+class SensorWriter(BatchWriter):
+    """Ghi số liệu cảm biến từ luồng MQTT xuống bảng sensor_data theo lô
+
+    Cùng transaction đó cập nhật các bảng tổng hợp 1 phút/1 giờ/1 ngày với
+    giá trị của cảm biến vừa gửi số liệu.
+    """
+
+    def __init__(self, db: Database, batch_size: int = 50,
+                 flush_interval: float = 2.0, max_buffer: int = 1000):
+        super().__init__(
+            "INSERT INTO sensor_data (timestamp, temperature, humidity, light, moisture) VALUES (?, ?, ?, ?, ?)",
+            db, batch_size, flush_interval, max_buffer, name="sensor-writer",
+        )
+
+    def add(self, row: SensorRow, sensor: Optional[str] = None) -> bool:
+        """Thêm một bản ghi (timestamp epoch ms, temperature, humidity, light, moisture)
+
+        ``sensor`` là tên cột của cảm biến vừa gửi số liệu, chỉ cột đó được
+        cộng vào bảng tổng hợp; các cột của cảm biến không gửi là None (NULL).
+        """
+        return super().add((*row, sensor))
+
+    def write(self, conn: sqlite3.Connection, rows: List[Sequence]):
+        conn.executemany(self.insert_sql, [row[:5] for row in rows])
+        readings = [
+            (row[0], row[5], row[1 + SENSORS.index(row[5])])
+            for row in rows if row[5] in SENSORS
+        ]
+        update_rollups(conn, readings)
@@ -7,8 +7,9 @@ from datetime import datetime
 from logger_config import smart_garden_logger as logger
 
 class SmartController:
-    def __init__(self, mqtt_client):
-        self.device_manager = DeviceStateManager()
+    def __init__(self, mqtt_client, device_manager=None):
+        # Dùng chung DeviceStateManager với app để thấy trạng thái Raspberry gửi lên
+        self.device_manager = device_manager or DeviceStateManager()
         self.mqtt_client = mqtt_client
         self.disease_controls = {
             "Anthracnose": {  # Bệnh thán thư
@@ -86,13 +87,13 @@ class SmartController:
             # Bật thiết bị
             self.mqtt_client.publish("motor/control",
                 json.dumps({"motor": motor_num, "state": "run"}))
-            self.device_manager.set_device_state(device_id, "OPEN", "smart")
+            self.device_manager.set_device_state(device_id, "OPEN", "smart", action["device"])
             
             # Tự động tắt sau thời gian định sẵn
             def auto_stop():
                 time.sleep(action["duration"])
                 self.mqtt_client.publish("motor/control",
                     json.dumps({"motor": motor_num, "state": "stop"}))
-                self.device_manager.set_device_state(device_id, "CLOSED", "smart")
+                self.device_manager.set_device_state(device_id, "CLOSED", "smart", action["device"])
                 
             threading.Thread(target=auto_stop, daemon=True).start()